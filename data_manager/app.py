@@ -4,28 +4,52 @@ from flask import Flask, flash, request, redirect, url_for, send_from_directory
 from flask_swagger_ui import get_swaggerui_blueprint
 from flask import Flask, request, redirect, url_for
 from flask_migrate import Migrate, MigrateCommand
-from sqlalchemy import update, create_engine
+from sqlalchemy import update, text, func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import OperationalError
 from werkzeug.utils import secure_filename
 from flask_jwt_extended import JWTManager
 from flask_httpauth import HTTPBasicAuth
 from flask_sqlalchemy import SQLAlchemy
-from geoserver.catalog import Catalog
 from geojson import Feature, Point
 from flask import Flask, jsonify
 from flask import make_response
+from flask import Response, stream_with_context
+from flask import json as flask_json
 from zipfile import ZipFile
 from flask_cors import CORS
 from flask import request
 from flask import url_for
 from flask import abort
 from models import *
+from cache import LRUCache, RevokedTokenIndex
+from spatial import load_geometry, contains_many, ExtentIndex
+from functools import wraps, partial
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+import loaders
+from jobs import JobQueue
+from publisher import get_publisher
+from engines import engines
 import pandas as pd
-import subprocess
+import tempfile
 import argparse
 import requests
+import itertools
+import time
+import threading
+import multiprocessing
+import queue
+import uuid
+import copy
+import hashlib
+import shutil
+import math
+import re
 import datetime
 import os.path
 import geojson
+import ijson
 import json
 import xlrd
 import os
@@ -48,13 +72,46 @@ TBRD_REPO_DB_PASS = get_env_variable("TBRD_REPO_DB_PASS")
 API_HOST = get_env_variable("API_HOST")
 KUBERNETES_API_PORT = get_env_variable("KUBERNETES_API_PORT")
 CKAN_API_PORT = get_env_variable("CKAN_API_PORT")
+BBOX_SEARCH_ENGINE = os.environ.get("BBOX_SEARCH_ENGINE", "postgis")
+CKAN_API_HOST = os.environ.get("CKAN_API_HOST", API_HOST)
+CKAN_URL = CKAN_API_HOST + ':' + CKAN_API_PORT
+BBOX_CACHE_SIZE = int(os.environ.get("BBOX_CACHE_SIZE", "100000"))
+BBOX_CACHE_TTL = int(os.environ.get("BBOX_CACHE_TTL", "3600"))
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "2"))
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", "100"))
+INGEST_JOB_TTL = int(os.environ.get("INGEST_JOB_TTL", "86400"))
+GEOSERVER_CACHE_TTL = int(os.environ.get("GEOSERVER_CACHE_TTL", "300"))
+INGEST_TIMEOUT = int(os.environ.get("INGEST_TIMEOUT", "3600"))
+UPLOAD_WORKSPACE_TTL = 2 * INGEST_TIMEOUT
+HOST_CACHE_TTL = int(os.environ.get("HOST_CACHE_TTL", "300"))
+INGEST_PROCESSES = int(os.environ.get("INGEST_PROCESSES", str(os.cpu_count() or 2)))
 
 APP_ROOT = os.path.dirname(os.path.abspath(__file__))
 UPLOAD_FOLDER = os.path.join(APP_ROOT, 'static')
+CHUNKED_FOLDER = os.path.join(UPLOAD_FOLDER, '.chunked')
+WORKSPACES_FOLDER = os.path.join(UPLOAD_FOLDER, '.workspaces')
+WORKSPACES_MEMORY_ROOT = os.environ.get("WORKSPACES_MEMORY_ROOT", "/dev/shm")
+WORKSPACES_MEMORY_FOLDER = os.path.join(WORKSPACES_MEMORY_ROOT, 'tbrd-uploads')
+CHUNK_SIZE = 8 * 1024 * 1024
+CHUNK_SIZE_MIN = 256 * 1024
+CHUNK_SIZE_MAX = 64 * 1024 * 1024
+CHUNKED_UPLOAD_MAX_CHUNKS = 100000
+CHUNKED_UPLOAD_MAX_SIZE = int(os.environ.get("CHUNKED_UPLOAD_MAX_SIZE", str(50 * 1024 * 1024 * 1024)))
+CHUNKED_UPLOAD_TTL = 7 * 24 * 3600
+COPY_BUFFER = 1024 * 1024
+PAGE_LIMIT = 1000
+STREAM_CHUNK = 500
+REPOSITORIE_CACHE_SIZE = 1024
+REVOKED_TOKENS_REFRESH = 30
+REVOKED_TOKENS_COMPACTION = 3600
+DATASET_EXTENTS_SYNC = 600
+DATASET_EXTENTS_RECONCILE = 6 * 3600
+CKAN_SYNC_ROWS = 1000
+BBOX_SEARCH_BATCH = 1000
 
 #app
 app = Flask(__name__)
-cors = CORS(app)
+cors = CORS(app, expose_headers=['X-Next-Cursor', 'ETag'])
 
 db.init_app(app)
 
@@ -66,11 +123,49 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
 jwt = JWTManager(app)
 
+#index of dataset extents
+extent_index = ExtentIndex()
+
+#time of the last full dataset extents sync, the first sync after a deploy is full
+extents_reconciled = 0
+
+#cache of bbox containment verdicts
+bbox_cache = LRUCache(BBOX_CACHE_SIZE, ttl=BBOX_CACHE_TTL)
+
+#cache of repositorie documents
+repositorie_cache = LRUCache(REPOSITORIE_CACHE_SIZE)
+
+#upload ingestion jobs, run by a pool of worker threads
+ingest_jobs = JobQueue(INGEST_WORKERS, maxsize=INGEST_QUEUE_SIZE, ttl=INGEST_JOB_TTL, context=app.app_context)
+
+#cache of host addresses by name
+host_cache = LRUCache(64, ttl=HOST_CACHE_TTL)
+
+#uploads with the same content hash are ingested one at a time, locks by content hash with their users
+upload_locks = {}
+upload_locks_lock = threading.Lock()
+
+#workspaces of uploads being received, queued or ingested, never swept
+active_workspaces = set()
+active_workspaces_lock = threading.Lock()
+
+#shapefile loading processes, shared by every upload job
+ingest_pool = None
+ingest_pool_lock = threading.Lock()
+
+#catalog versions
+catalog_versions = {'repositories': 0, 'groups': 0}
+catalog_lock = threading.Lock()
+CATALOG_BOOT_ID = uuid.uuid4().hex[:8]
+
+#revoked tokens index
+revoked_index = RevokedTokenIndex(RevokedTokenModel.revoked_since, RevokedTokenModel.is_jti_blacklisted, refresh=REVOKED_TOKENS_REFRESH)
+
 #check_if_token_in_blacklist
 @jwt.token_in_blacklist_loader
 def check_if_token_in_blacklist(decrypted_token):
     jti = decrypted_token['jti']
-    return RevokedTokenModel.is_jti_blacklisted(jti)
+    return revoked_index.contains(jti)
 
 ### swagger specific ###
 SWAGGER_URL = '/swagger'
@@ -91,34 +186,192 @@ app.config['SQLALCHEMY_DATABASE_URI'] = DB_URL
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False # silence the deprecation warning
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
-#check_bbox
-def check_bbox(spatial, bbox):
+#parse geometry
+def parse_geometry(value):
 
     #geojson
-    spatial = geojson.loads(spatial)
-    bbox = geojson.loads(bbox)
+    geometry = geojson.loads(value) if isinstance(value, str) else value
 
-    if (bbox['type'] == 'FeatureCollection'):
-        bbox = bbox['features'][0]
+    if (geometry['type'] == 'FeatureCollection'):
+        geometry = geometry['features'][0]
+    if (geometry['type'] == 'Feature'):
+        geometry = geometry['geometry']
 
-    # create db engine
-    engine = create_engine(DB_URL)
+    return geometry
 
-    #connect
-    with engine.connect() as con:
-        rs = con.execute('SELECT ST_Contains(ST_GeomFromGeoJSON($$'+str(bbox.geometry)+'$$), ST_GeomFromGeoJSON($$'+str(spatial.geometry)+'$$))')
-        for row in rs:
-            return(row[0])
+#check_bbox
+def check_bbox(spatial, bbox):
+    try:
+        with db.engine.connect() as con:
+            rs = con.execute(text('SELECT ST_Contains(ST_GeomFromGeoJSON(:bbox), ST_GeomFromGeoJSON(:spatial))'), bbox=json.dumps(bbox), spatial=json.dumps(spatial))
+            for row in rs:
+                return bool(row[0])
+    except:
+        # no verdict, so it is not cached as "not contained"
+        return None
 
-#check_spatial
-def check_spatial(in_json, bbox):
+#get_spatial
+def get_spatial(in_json):
     try:
         for extra_item in in_json['extras']:
             if extra_item['key'] == 'spatial':
-                return check_bbox(extra_item['value'], bbox)
+                return parse_geometry(extra_item['value'])
+    except:
+        return None
+
+#check_bboxes
+def check_bboxes(spatials, bbox):
+
+    verdicts = [False] * len(spatials)
+    items = [(i, spatial) for i, spatial in enumerate(spatials) if spatial is not None]
+    if (len(items) == 0):
+        return verdicts
+
+    #one statement for every dataset
+    query = text(
+        'SELECT t.ord, ST_Contains(b.geom, ST_GeomFromGeoJSON(t.spatial)) '
+        'FROM (SELECT ST_GeomFromGeoJSON(:bbox) AS geom) b, '
+        'unnest(CAST(:spatials AS text[]), CAST(:ords AS int[])) AS t(spatial, ord)')
+    try:
+        with db.engine.connect() as con:
+            rs = con.execute(query, bbox=json.dumps(bbox), spatials=[json.dumps(e[1]) for e in items], ords=[e[0] for e in items])
+            for row in rs:
+                verdicts[row[0]] = bool(row[1])
+
+    except OperationalError:
+        #database unavailable, leave these undecided
+        for i, spatial in items:
+            verdicts[i] = None
+
+    except:
+        #a malformed geometry fails the whole statement, test one by one
+        for i, spatial in items:
+            verdicts[i] = check_bbox(spatial, bbox)
+
+    return verdicts
+
+#check_bboxes in memory
+def check_bboxes_memory(spatials, bbox):
+
+    #undecided boundary cases are left to PostGIS
+    def fallback(idx):
+        return check_bboxes([spatials[i] for i in idx], bbox)
+
+    geometries = [load_geometry(spatial) if spatial is not None else None for spatial in spatials]
+    return contains_many(load_geometry(bbox), geometries, fallback)
+
+#spatial predicates of the batch search, region against dataset extent
+SPATIAL_PREDICATES = {
+    'contains': 'ST_Contains(r.geom, d.geom)',
+    'within': 'ST_Within(r.geom, d.geom)',
+    'intersects': 'ST_Intersects(r.geom, d.geom)'
+}
+
+#search many regions
+def search_regions(regions, spatials, predicate):
+
+    matches = [[] for region in regions]
+
+    #every dataset extent is parsed once
+    geometries = [load_geometry(spatial) if spatial is not None else None for spatial in spatials]
+    valid = [i for i, geometry in enumerate(geometries) if geometry is not None]
+    if (len(valid) == 0 or len(regions) == 0):
+        return matches
+
+    if (predicate == 'contains' and request.args.get('engine', BBOX_SEARCH_ENGINE) == 'memory'):
+        for k, region in enumerate(regions):
+            verdicts = contains_many(load_geometry(region), [geometries[i] for i in valid],
+                lambda idx: check_bboxes([spatials[valid[i]] for i in idx], region))
+            matches[k] = [valid[j] for j, verdict in enumerate(verdicts) if verdict]
+        return matches
+
+    #one statement for every region and dataset
+    query = text(
+        'WITH r AS (SELECT t.ord, ST_GeomFromGeoJSON(t.geom) AS geom '
+        'FROM unnest(CAST(:regions AS text[]), CAST(:rords AS int[])) AS t(geom, ord)), '
+        'd AS (SELECT t.ord, ST_GeomFromGeoJSON(t.geom) AS geom '
+        'FROM unnest(CAST(:spatials AS text[]), CAST(:ords AS int[])) AS t(geom, ord)) '
+        'SELECT r.ord, d.ord FROM r JOIN d ON r.geom && d.geom AND ' + SPATIAL_PREDICATES[predicate] + ' '
+        'ORDER BY r.ord, d.ord')
+
+    def run(rords, ords):
+        with db.engine.connect() as con:
+            rs = con.execute(query,
+                regions=[json.dumps(regions[k]) for k in rords], rords=rords,
+                spatials=[json.dumps(spatials[i]) for i in ords], ords=ords)
+            for row in rs:
+                matches[row[0]].append(row[1])
+
+    try:
+        run(list(range(len(regions))), valid)
+    except OperationalError:
+        raise
+    except:
+        #a geometry PostGIS rejects fails the whole statement, leave out the ones that fail alone and run again
+        matches = [[] for region in regions]
+        run([k for k in range(len(regions)) if check_predicate(regions[k], predicate)],
+            [i for i in valid if check_predicate(spatials[i], predicate)])
+
+    return matches
+
+#check a geometry against itself with a predicate
+def check_predicate(geometry, predicate):
+    try:
+        with db.engine.connect() as con:
+            con.execute(text('SELECT ' + SPATIAL_PREDICATES[predicate] + ' FROM (SELECT ST_GeomFromGeoJSON(:geom) AS geom) r, (SELECT ST_GeomFromGeoJSON(:geom) AS geom) d'),
+                geom=json.dumps(geometry)).fetchall()
+        return True
     except:
         return False
 
+#check datasets with cached verdicts
+def check_datasets(datasets, bbox, bbox_key, stats):
+
+    # verdicts are keyed by bbox and dataset revision
+    keys = []
+    for item in datasets:
+        try:
+            keys.append((bbox_key, item['id'], item['metadata_modified']))
+        except:
+            keys.append(None)
+
+    verdicts = [None] * len(datasets)
+    for i, key in enumerate(keys):
+        if (key is not None):
+            verdicts[i] = bbox_cache.get(key)
+
+    missing = [i for i, verdict in enumerate(verdicts) if verdict is None]
+    stats['hits'] += len(datasets) - len(missing)
+    stats['misses'] += len(missing)
+
+    if (len(missing) > 0):
+        spatials = [get_spatial(datasets[i]) for i in missing]
+        if (request.args.get('engine', BBOX_SEARCH_ENGINE) == 'memory'):
+            computed = check_bboxes_memory(spatials, bbox)
+        else:
+            computed = check_bboxes(spatials, bbox)
+        for i, verdict in zip(missing, computed):
+            verdicts[i] = verdict
+            if (keys[i] is not None and verdict is not None):
+                bbox_cache.set(keys[i], verdict)
+
+    return verdicts
+
+#check dataset extents in PostGIS
+def check_dataset_extents(dataset_ids, bbox):
+    rows = (db.session.query(DatasetExtent.dataset_id, func.ST_Contains(func.ST_SetSRID(func.ST_GeomFromGeoJSON(json.dumps(bbox)), 4326), DatasetExtent.extent))
+        .filter(DatasetExtent.dataset_id.in_(dataset_ids))
+        .all())
+    verdicts = dict(rows)
+    return [bool(verdicts.get(dataset_id)) for dataset_id in dataset_ids]
+
+#search response
+def make_search_response(datasets_spatial, stats=None):
+    return_dict = dict(help="http://localhost:5000/api/3/action/help_show?name=package_search", success="true", result = dict(count= len(datasets_spatial), sort= "score desc, metadata_modified desc", facets={}, results=datasets_spatial))
+    if (stats is not None):
+        return_dict['result']['cache'] = stats
+    return jsonify(return_dict)
+
 #errorhandler
 @app.errorhandler(404)
 def not_found(error):
@@ -160,25 +413,486 @@ def make_public_service(service):
             new_service[field] = service[field]
     return new_service
 
-#get_shapefile_name
-def get_shapefile_name(path):
-    with ZipFile(path, 'r') as zipObj:
-        listOfiles = zipObj.namelist()
-        for elem in listOfiles:
-            if(elem.rsplit('.', 1)[1].lower() == 'shp'):
-                return elem
+#build repositorie documents
+def make_repositorie_documents(repositories, single_port=False):
+
+    #cached documents
+    generation = repositorie_cache.generation
+    repositories = list(repositories)
+    json_docs = {}
+    missing = []
+    for e in repositories:
+        val = repositorie_cache.get(e.repo_id)
+        if val is None:
+            missing.append(e)
+        else:
+            json_docs[e.repo_id] = val
+
+    if(len(missing) > 0):
+        for val in query_repositorie_documents(missing):
+            repositorie_cache.set(val['repo_id'], val, generation)
+            json_docs[val['repo_id']] = val
+
+    return [format_repositorie_document(json_docs[e.repo_id], single_port) for e in repositories]
+
+#copy cached document
+def format_repositorie_document(json_doc, single_port=False):
+    val = copy.deepcopy(json_doc)
+    if (single_port):
+        for ser in val['services']:
+            ser.update({ "ports" : str(ser['ports'][0]) if len(ser['ports']) > 0 else '' })
+    return val
+
+#invalidate repositorie documents
+def invalidate_repositories(repo_ids):
+    for repo_id in repo_ids:
+        repositorie_cache.pop(int(repo_id))
+
+#invalidate repositorie documents of a service
+def invalidate_service_repositories(service_id):
+    repo_ser = Repositorie_Service.query.filter_by(service_id=service_id)
+    invalidate_repositories([e.repo_id for e in repo_ser])
+
+#query repositorie documents
+def query_repositorie_documents(repositories):
+
+    #get lists
+    data = ([(make_public_repositorie(e.serialize())) for e in repositories])
+    repo_ids = ([e['repo_id'] for e in data])
+
+    if(len(repo_ids) == 0):
+        return []
+
+    #services and hosts of all repositories
+    repo_ser = (db.session.query(Repositorie_Service.repo_id, Service, Host.address)
+        .join(Service, Service.service_id == Repositorie_Service.service_id)
+        .join(Host, Host.host_id == Service.host_id)
+        .filter(Repositorie_Service.repo_id.in_(repo_ids))
+        .order_by(Repositorie_Service.repo_id, Service.service_id)
+        .all())
+
+    #ports of all services
+    list_ser = list(set([e[1].service_id for e in repo_ser]))
+    json_ports = {}
+    if(len(list_ser) > 0):
+        ser_port = (db.session.query(Service_Port.service_id, Port.port)
+            .join(Port, Port.port_id == Service_Port.port_id)
+            .filter(Service_Port.service_id.in_(list_ser))
+            .order_by(Service_Port.service_id, Port.port_id)
+            .all())
+        for service_id, port in ser_port:
+            json_ports.setdefault(service_id, []).append(port)
+
+    #categories of all repositories
+    repo_cat = (db.session.query(Repositorie_Categorie.repo_id, Categorie.name)
+        .join(Categorie, Categorie.categorie_id == Repositorie_Categorie.categorie_id)
+        .filter(Repositorie_Categorie.repo_id.in_(repo_ids))
+        .order_by(Repositorie_Categorie.repo_id, Categorie.categorie_id)
+        .all())
+
+    #create services dict
+    json_ser = {}
+    for repo_id, service, address in repo_ser:
+        ser = make_public_service(service.serialize())
+        ser.update({ "ports" : json_ports.get(service.service_id, []) })
+        ser.update({ "address" : str(address) })
+        del ser['host_id']
+        del ser['machine']
+        del ser['service_id']
+        json_ser.setdefault(repo_id, []).append(ser)
+
+    #create categories dict
+    json_cate = {}
+    for repo_id, name in repo_cat:
+        json_cate.setdefault(repo_id, []).append(name)
+
+    #compose
+    for val in data:
+        val.update({"services": json_ser.get(val['repo_id'], [])})
+        val.update({"categories": json_cate.get(val['repo_id'], [])})
+
+    return data
+
+#build group documents
+def make_group_documents(groups):
+
+    #get lists
+    data = ([(make_public_group(e.serialize())) for e in groups])
+    group_ids = ([e['group_id'] for e in data])
+
+    if(len(group_ids) == 0):
+        return []
+
+    #members of all groups
+    grup_usr = (db.session.query(Groups_User.group_id, User)
+        .join(User, User.user_id == Groups_User.user_id)
+        .filter(Groups_User.group_id.in_(group_ids))
+        .order_by(Groups_User.group_id, User.user_id)
+        .all())
+
+    #create users dict
+    json_users = {}
+    for group_id, user in grup_usr:
+        json_users.setdefault(group_id, []).append(make_public_user(user.serialize()))
+
+    #compose
+    for val in data:
+        val.update({"users": json_users.get(val['group_id'], [])})
+
+    return data
+
+#equality filters
+def filter_query(query, filters):
+    for field in filters:
+        value = request.args.get(field)
+        if value is not None:
+            query = query.filter_by(**{field: value})
+    return query
+
+#cursor and limit
+def page_args():
+    # checked before the routes' try blocks, so a bad value answers 400
+    try:
+        cursor = request.args.get('cursor')
+        cursor = None if cursor is None else int(cursor)
+        limit = int(request.args.get('limit', PAGE_LIMIT))
+    except ValueError:
+        abort(400)
+    if (limit < 1):
+        abort(400)
+    return cursor, min(limit, PAGE_LIMIT)
+
+#keyset pagination
+def paginate(query, key, filters=(), cursor=None, limit=PAGE_LIMIT):
+
+    # equality filters
+    query = filter_query(query, filters)
+
+    if (cursor is not None):
+        query = query.filter(key > cursor)
+
+    rows = query.order_by(key).limit(limit + 1).all()
+
+    # next cursor
+    next_cursor = None
+    if (len(rows) > limit):
+        rows = rows[:limit]
+        next_cursor = getattr(rows[-1], key.key)
+
+    return rows, next_cursor
+
+#next cursor header
+def make_paginated_response(json_response, next_cursor):
+    response = jsonify(json_response)
+    if (next_cursor is not None):
+        response.headers['X-Next-Cursor'] = str(next_cursor)
+    return response
+
+#streaming requested
+def is_streaming():
+    return request.args.get('stream', 'false').lower() in ['1', 'true']
+
+#streaming json
+def make_streaming_response(query, key, filters, make_documents, name=None, cursor=None):
+
+    # equality filters and cursor
+    query = filter_query(query, filters)
+    if (cursor is not None):
+        query = query.filter(key > cursor)
+
+    # server-side cursor
+    query = query.order_by(key).execution_options(stream_results=True).yield_per(STREAM_CHUNK)
 
-#check if filetype
-def check_filetype_name(path, ftype):
+    if (name is None):
+        prefix, suffix, empty = '[', ']', '[]'
+    else:
+        prefix, suffix, empty = '{' + flask_json.dumps(name) + ':[', ']}', '{}'
+
+    def generate():
+        rows = iter(query)
+        count = 0
+        while True:
+            chunk = list(itertools.islice(rows, STREAM_CHUNK))
+            if (len(chunk) == 0):
+                break
+            for val in make_documents(chunk):
+                yield (prefix if count == 0 else ',') + flask_json.dumps(val)
+                count += 1
+        yield (empty if count == 0 else suffix)
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+#bump catalog version
+def bump_catalog_version(*families):
+    with catalog_lock:
+        for family in families:
+            catalog_versions[family] += 1
+
+#catalog etag
+def catalog_etag(*families):
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+
+            # version is read before the view runs, a concurrent write only makes the etag stale
+            with catalog_lock:
+                versions = '-'.join([str(catalog_versions[family]) for family in families])
+            etag = '{}-{}-{}'.format(CATALOG_BOOT_ID, versions, uuid.uuid5(uuid.NAMESPACE_URL, request.full_path).hex[:12])
+
+            if (request.if_none_match.contains(etag)):
+                response = make_response('', 304)
+                response.set_etag(etag)
+                return response
+
+            response = make_response(f(*args, **kwargs))
+            if (response.status_code == 200 and response.mimetype == 'application/json'):
+                response.set_etag(etag)
+            return response
+        return wrapper
+    return decorator
+
+#get_host_address
+def get_host_address(name):
+    address = host_cache.get(name)
+    if address is None:
+        host = Host.query.filter_by(name=name).first()
+        address = host.serialize()['address']
+        host_cache.set(name, address)
+    return address
+
+#get_shapefile_names
+def get_shapefile_names(path):
     with ZipFile(path, 'r') as zipObj:
         listOfiles = zipObj.namelist()
-        list_ext = []
-        for elem in listOfiles:
-            list_ext.append(elem.rsplit('.', 1)[1].lower())
-        if (ftype in list_ext):
-            return True
-        else:
-            return False
+        # macOS resource forks (__MACOSX/, ._name.shp) are not shapefiles
+        return [elem for elem in listOfiles if elem.lower().endswith('.shp')
+            and not elem.startswith('__MACOSX/') and not elem.rsplit('/', 1)[-1].startswith('._')]
+
+#get ingest pool
+def get_ingest_pool():
+    global ingest_pool
+    with ingest_pool_lock:
+        if ingest_pool is None:
+            # spawned workers re-import this module as __mp_main__, which builds the app but skips app.run,
+            # and the job and periodic threads only start on the first request, so none run in the workers
+            ingest_pool = ProcessPoolExecutor(INGEST_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+        return ingest_pool
+
+#drop late layer
+def drop_late_layer(connect_args, future):
+    # a layer still loading when its ingest timed out is never published, its table is dropped once the load ends
+    if (future.cancelled() or future.exception() is not None):
+        return
+    table = future.result()['table']
+    try:
+        with engines.connect(**connect_args) as connection:
+            loaders.drop_table(connection, table)
+    except Exception as e:
+        app.logger.error('Table {} of a timed out layer not dropped: {}'.format(table, e))
+
+#compact revoked tokens
+def compact_revoked_tokens():
+    removed = RevokedTokenModel.delete_expired(datetime.datetime.utcnow())
+    if (removed > 0):
+        revoked_index.reset()
+    return removed
+
+#periodic job
+def start_periodic_job(name, interval, job, initial=False):
+    def run():
+        wait = 0 if initial else interval
+        while True:
+            time.sleep(wait)
+            wait = interval
+            with app.app_context():
+                try:
+                    job()
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error('{} failed: {}'.format(name, e))
+    thread = threading.Thread(target=run, name=name)
+    thread.daemon = True
+    thread.start()
+
+#load dataset extents
+def load_extent_index():
+    rows = db.session.query(DatasetExtent.dataset_id, func.ST_AsGeoJSON(DatasetExtent.extent)).all()
+    extent_index.load([(dataset_id, json.loads(extent)) for dataset_id, extent in rows])
+
+#ckan datetime
+def parse_ckan_datetime(value):
+    return datetime.datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S')
+
+#sync dataset extents
+def sync_dataset_extents(full=False):
+
+    # incremental sync starts at the newest modification already indexed
+    last_modified = None
+    if not full:
+        last_modified = db.session.query(func.max(DatasetExtent.metadata_modified)).scalar()
+
+    seen = set()
+    updated = 0
+    removed = 0
+    start = 0
+    while True:
+        params = {'rows': CKAN_SYNC_ROWS, 'start': start, 'sort': 'metadata_modified asc'}
+        if (last_modified is not None):
+            params['fq'] = 'metadata_modified:[{}Z TO *]'.format(last_modified.isoformat())
+
+        r = requests.get(CKAN_URL + '/api/3/action/package_search', params=params, timeout=60)
+        r.raise_for_status()
+        results = r.json()['result']['results']
+
+        for package in results:
+            seen.add(package['id'])
+            spatial = get_spatial(package)
+
+            # datasets without a usable extent leave the index
+            if (spatial is None or load_geometry(spatial) is None):
+                removed += DatasetExtent.query.filter_by(dataset_id=package['id']).delete(synchronize_session=False)
+                continue
+
+            stmt = insert(DatasetExtent.__table__).values(
+                dataset_id = package['id'],
+                name = package['name'],
+                metadata_modified = parse_ckan_datetime(package['metadata_modified']),
+                extent = func.ST_SetSRID(func.ST_GeomFromGeoJSON(json.dumps(spatial)), 4326),
+                package = package)
+            stmt = stmt.on_conflict_do_update(index_elements=['dataset_id'], set_=dict(
+                name = stmt.excluded.name,
+                metadata_modified = stmt.excluded.metadata_modified,
+                extent = stmt.excluded.extent,
+                package = stmt.excluded.package))
+            try:
+                with db.session.begin_nested():
+                    db.session.execute(stmt)
+                updated += 1
+            except Exception as e:
+                app.logger.warning('Dataset {} has an invalid extent: {}'.format(package['id'], e))
+
+        start += len(results)
+        if (len(results) < CKAN_SYNC_ROWS):
+            break
+
+    # a full sync also drops datasets removed from CKAN
+    if full:
+        query = DatasetExtent.query
+        if (len(seen) > 0):
+            query = query.filter(~DatasetExtent.dataset_id.in_(list(seen)))
+        removed += query.delete(synchronize_session=False)
+
+    db.session.commit()
+    load_extent_index()
+
+    return {'updated': updated, 'removed': removed, 'indexed': len(extent_index)}
+
+#sync dataset extents periodically
+def sync_dataset_extents_periodic():
+    global extents_reconciled
+
+    # incremental syncs miss datasets deleted or made private in CKAN, a full one reconciles them now and then
+    full = time.time() - extents_reconciled > DATASET_EXTENTS_RECONCILE
+    result = sync_dataset_extents(full)
+    if full:
+        extents_reconciled = time.time()
+    return result
+
+#chunked upload directory
+def chunked_upload_dir(upload_id):
+    path = os.path.join(CHUNKED_FOLDER, upload_id)
+    if not re.match('^[0-9a-f]{32}$', upload_id) or not os.path.isdir(path):
+        abort(404)
+    return path
+
+#chunked upload manifest
+def read_chunked_manifest(path):
+    with open(os.path.join(path, 'manifest.json')) as f:
+        return json.load(f)
+
+#received chunks
+def received_chunks(path):
+    return sorted([int(e) for e in os.listdir(os.path.join(path, 'chunks')) if e.isdigit()])
+
+#remove abandoned chunked uploads
+def clean_chunked_uploads():
+    if not os.path.isdir(CHUNKED_FOLDER):
+        return 0
+    removed = 0
+    for upload_id in os.listdir(CHUNKED_FOLDER):
+        path = os.path.join(CHUNKED_FOLDER, upload_id)
+        if (time.time() - os.path.getmtime(path) > CHUNKED_UPLOAD_TTL):
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+    return removed
+
+#make upload workspace
+def make_upload_workspace(size=None, memory=True):
+    # tmpfs is used only when it has room to spare for the upload
+    base = WORKSPACES_FOLDER
+    if (memory and os.path.isdir(WORKSPACES_MEMORY_ROOT) and os.access(WORKSPACES_MEMORY_ROOT, os.W_OK)):
+        if (size is not None and shutil.disk_usage(WORKSPACES_MEMORY_ROOT).free > 2 * size):
+            base = WORKSPACES_MEMORY_FOLDER
+    os.makedirs(base, exist_ok=True)
+    workspace = tempfile.mkdtemp(prefix='upload-', dir=base)
+    with active_workspaces_lock:
+        active_workspaces.add(workspace)
+    return workspace
+
+#remove upload workspace
+def remove_upload_workspace(workspace):
+    shutil.rmtree(workspace, ignore_errors=True)
+    with active_workspaces_lock:
+        active_workspaces.discard(workspace)
+
+#hash file
+def hash_file(path):
+    sha = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(COPY_BUFFER), b''):
+            sha.update(block)
+            size += len(block)
+    return sha.hexdigest(), size
+
+#publish upload
+def publish_upload(workspace, name):
+    # moves a file or directory from the workspace to the served uploads folder
+    target = os.path.join(UPLOAD_FOLDER, name)
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+    shutil.move(os.path.join(workspace, name), target)
+
+#clean upload workspaces
+def clean_upload_workspaces():
+    removed = 0
+    for base in [WORKSPACES_FOLDER, WORKSPACES_MEMORY_FOLDER]:
+        if not os.path.isdir(base):
+            continue
+        for name in os.listdir(base):
+            path = os.path.join(base, name)
+            with active_workspaces_lock:
+                if (path in active_workspaces):
+                    continue
+            if (time.time() - os.path.getmtime(path) > UPLOAD_WORKSPACE_TTL):
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+    return removed
+
+#load indexes
+@app.before_first_request
+def load_indexes():
+    revoked_index.sync()
+    try:
+        load_extent_index()
+    except Exception as e:
+        db.session.rollback()
+        app.logger.error('Dataset extents index not loaded: {}'.format(e))
+    start_periodic_job('revoked-tokens-compaction', REVOKED_TOKENS_COMPACTION, compact_revoked_tokens)
+    start_periodic_job('dataset-extents-sync', DATASET_EXTENTS_SYNC, sync_dataset_extents_periodic, initial=True)
+    start_periodic_job('chunked-uploads-cleanup', CHUNKED_UPLOAD_TTL / 7, clean_chunked_uploads)
+    start_periodic_job('upload-workspaces-cleanup', UPLOAD_WORKSPACE_TTL / 4, clean_upload_workspaces)
+    ingest_jobs.start()
 
 #+--------------------------------------------------------+
 #| Create users                                           |
@@ -208,6 +922,7 @@ def create_user():
         )
         db.session.add(user)
         db.session.commit()
+        bump_catalog_version('groups')
 
         access_token = create_access_token(identity = request.json['username'], expires_delta = datetime.timedelta(days=365))
         refresh_token = create_refresh_token(identity = request.json['username'], expires_delta = datetime.timedelta(days=365))
@@ -226,9 +941,14 @@ def create_user():
 #+--------------------------------------------------------+
 @app.route("/api/v1.0/users")
 def read_users():
+    cursor, limit = page_args()
     try:
-        users=User.query.all()
-        return jsonify([make_public_user(e.serialize()) for e in users])
+        filters = ['username', 'email']
+        if (is_streaming()):
+            return make_streaming_response(User.query, User.user_id, filters, lambda rows: [make_public_user(e.serialize()) for e in rows], cursor=cursor)
+
+        users, next_cursor = paginate(User.query, User.user_id, filters, cursor, limit)
+        return make_paginated_response([make_public_user(e.serialize()) for e in users], next_cursor)
     except Exception as e:
 	    return(str(e))
 
@@ -277,6 +997,7 @@ def update_user(user_id):
         new_user.ckan_api_key = ckan_api_key
 
         db.session.commit()
+        bump_catalog_version('groups')
 
         return jsonify({'result': True})
     except Exception as e:
@@ -292,6 +1013,7 @@ def delete_user(user_id):
         user = db.session.query(User).filter_by(user_id=user_id).first()
         db.session.delete(user)
         db.session.commit()
+        bump_catalog_version('groups')
         return jsonify({'result': True})
     except Exception as e:
 	    return(str(e))
@@ -313,6 +1035,7 @@ def create_group_repositorie_rel():
         )
         db.session.add(group_repositorie)
         db.session.commit()
+        bump_catalog_version('repositories')
         return jsonify({'result': True})
     except Exception as e:
         return(str(e))
@@ -338,6 +1061,7 @@ def delete_group_repositorie_rel(group_id,repo_id):
         group_repositorie = db.session.query(Repositorie_Group).filter_by(group_id=group_id, repo_id=repo_id).first()
         db.session.delete(group_repositorie)
         db.session.commit()
+        bump_catalog_version('repositories')
         return jsonify({'result': True})
     except Exception as e:
 	    return(str(e))
@@ -359,6 +1083,7 @@ def create_user_group_rel():
         )
         db.session.add(user_group)
         db.session.commit()
+        bump_catalog_version('groups', 'repositories')
         return jsonify({'result': True})
     except Exception as e:
         return(str(e))
@@ -373,6 +1098,7 @@ def delete_user_group_rel(user_id,group_id):
         group_user = db.session.query(Groups_User).filter_by(user_id=user_id, group_id=group_id).first()
         db.session.delete(group_user)
         db.session.commit()
+        bump_catalog_version('groups', 'repositories')
         return jsonify({'result': True})
     except Exception as e:
 	    return(str(e))
@@ -409,9 +1135,14 @@ def create_service():
 #+--------------------------------------------------------+
 @app.route("/api/v1.0/services", methods=['GET'])
 def read_services():
+    cursor, limit = page_args()
     try:
-        services=Service.query.all()
-        return jsonify([make_public_service(e.serialize()) for e in services])
+        filters = ['name', 'machine', 'host_id']
+        if (is_streaming()):
+            return make_streaming_response(Service.query, Service.service_id, filters, lambda rows: [make_public_service(e.serialize()) for e in rows], cursor=cursor)
+
+        services, next_cursor = paginate(Service.query, Service.service_id, filters, cursor, limit)
+        return make_paginated_response([make_public_service(e.serialize()) for e in services], next_cursor)
 
     except Exception as e:
 	    return(str(e))
@@ -437,6 +1168,7 @@ def delete_service(service_id):
         service = db.session.query(Service).filter_by(service_id=service_id).first()
         db.session.delete(service)
         db.session.commit()
+        bump_catalog_version('repositories')
         return jsonify({'result': True})
     except Exception as e:
 	    return(str(e))
@@ -458,6 +1190,8 @@ def create_service_repositorie_rel():
         )
         db.session.add(service_repositorie)
         db.session.commit()
+        bump_catalog_version('repositories')
+        invalidate_repositories([repo_id])
         return jsonify({'result': True})
     except Exception as e:
         return(str(e))
@@ -472,6 +1206,8 @@ def delete_service_repositorie_rel(service_id,repo_id):
         repo_service = db.session.query(Repositorie_Service).filter_by(service_id=service_id, repo_id=repo_id).first()
         db.session.delete(repo_service)
         db.session.commit()
+        bump_catalog_version('repositories')
+        invalidate_repositories([repo_id])
         return jsonify({'result': True})
     except Exception as e:
 	    return(str(e))
@@ -481,9 +1217,14 @@ def delete_service_repositorie_rel(service_id,repo_id):
 #+--------------------------------------------------------+
 @app.route("/api/v1.0/categories", methods=['GET'])
 def read_categories():
+    cursor, limit = page_args()
     try:
-        categories=Categorie.query.all()
-        return jsonify([e.serialize() for e in categories])
+        filters = ['name']
+        if (is_streaming()):
+            return make_streaming_response(Categorie.query, Categorie.categorie_id, filters, lambda rows: [e.serialize() for e in rows], cursor=cursor)
+
+        categories, next_cursor = paginate(Categorie.query, Categorie.categorie_id, filters, cursor, limit)
+        return make_paginated_response([e.serialize() for e in categories], next_cursor)
 
     except Exception as e:
 	    return(str(e))
@@ -524,6 +1265,8 @@ def create_categorie_repositorie_rel():
         )
         db.session.add(categorie_repositorie)
         db.session.commit()
+        bump_catalog_version('repositories')
+        invalidate_repositories([repo_id])
         return jsonify({'result': True})
     except Exception as e:
         return(str(e))
@@ -538,6 +1281,8 @@ def delete_categorie_repositorie_rel(categorie_id,repo_id):
         repo_categorie = db.session.query(Repositorie_Categorie).filter_by(categorie_id=categorie_id, repo_id=repo_id).first()
         db.session.delete(repo_categorie)
         db.session.commit()
+        bump_catalog_version('repositories')
+        invalidate_repositories([repo_id])
         return jsonify({'result': True})
     except Exception as e:
 	    return(str(e))
@@ -559,6 +1304,8 @@ def create_service_port_rel():
         )
         db.session.add(service_port)
         db.session.commit()
+        bump_catalog_version('repositories')
+        invalidate_service_repositories(service_id)
         return jsonify({'result': True})
     except Exception as e:
         return(str(e))
@@ -589,9 +1336,14 @@ def create_service_host_rel():
 #+--------------------------------------------------------+
 @app.route("/api/v1.0/hosts", methods=['GET'])
 def read_hosts():
+    cursor, limit = page_args()
     try:
-        hosts=Host.query.all()
-        return jsonify([e.serialize() for e in hosts])
+        filters = ['name', 'address']
+        if (is_streaming()):
+            return make_streaming_response(Host.query, Host.host_id, filters, lambda rows: [e.serialize() for e in rows], cursor=cursor)
+
+        hosts, next_cursor = paginate(Host.query, Host.host_id, filters, cursor, limit)
+        return make_paginated_response([e.serialize() for e in hosts], next_cursor)
 
     except Exception as e:
 	    return(str(e))
@@ -616,6 +1368,7 @@ def create_host():
         )
         db.session.add(host)
         db.session.commit()
+        host_cache.clear()
         hosts=Host.query.filter_by(address = request.json['address'])
         return jsonify([e.serialize() for e in hosts])
     except Exception as e:
@@ -681,7 +1434,9 @@ def create_repositorie():
         )
         db.session.add(repositorie)
         db.session.commit()
-        repositorie=Repositorie.query.filter_by(name = request.json['name'])
+        bump_catalog_version('repositories')
+        repositorie=Repositorie.query.filter_by(name = request.json['name']).all()
+        invalidate_repositories([e.repo_id for e in repositorie])
         return jsonify([e.serialize() for e in repositorie])
     except Exception as e:
         return(str(e))
@@ -690,89 +1445,23 @@ def create_repositorie():
 #| Read repositories                                      |
 #+--------------------------------------------------------+
 @app.route("/api/v1.0/repositories", methods=['GET'])
+@catalog_etag('repositories')
 def read_repositories():
+    cursor, limit = page_args()
     try:
-        #query all
-        repositories=Repositorie.query.all()
+        filters = ['name', 'path', 'maintainer']
+        if (is_streaming()):
+            return make_streaming_response(Repositorie.query, Repositorie.repo_id, filters, make_repositorie_documents, 'repositorie', cursor=cursor)
 
-        #get lists
-        data = ([(make_public_repositorie(e.serialize())) for e in repositories])
-        id_data = ([e.serialize() for e in repositories])
-
-        #create data dict
-        json_data = {}
-        for val in data:
-            json_data.setdefault('repositorie', []).append(val)
-
-        lista = []
+        #query page
+        repositories, next_cursor = paginate(Repositorie.query, Repositorie.repo_id, filters, cursor, limit)
 
         #create response dict
         json_response = {}
-        for i in range(len(data)):
-
-            #create lists
-            list_ser = []
-            list_cat = []
-            list_key = []
-
-            #create lists
-            repo_ser = Repositorie_Service.query.filter(Repositorie_Service.repo_id.in_([id_data[i]['repo_id']]))
-            r_ser = ([e.serialize() for e in repo_ser])
+        for val in make_repositorie_documents(repositories):
+            json_response.setdefault("repositorie", []).append(val)
 
-            repo_cat = Repositorie_Categorie.query.filter(Repositorie_Categorie.repo_id.in_([id_data[i]['repo_id']]))
-            r_cat = ([e.serialize() for e in repo_cat])
-
-            for j in range(len(r_ser)):
-                list_ser.append(r_ser[j]['service_id'])
-
-            for l in range(len(r_cat)):
-                list_cat.append(r_cat[l]['categorie_id'])
-
-            #create categories dict
-            categories=Categorie.query.filter(Categorie.categorie_id.in_(list_cat))
-            cate = ([e.serialize() for e in categories])
-            json_cate = {}
-            for val in cate:
-                json_cate.setdefault('categories', []).append(val['name'])
-
-            #create services dict
-            services = Service.query.filter(Service.service_id.in_(list_ser))
-            ser = ([make_public_service(e.serialize()) for e in services])
-            json_ser = {}
-            for val in ser:
-                json_ser.setdefault('services', []).append(val)
-
-            for n in range(len(ser)):
-                hosts = Host.query.filter(Host.host_id.in_([json_ser['services'][n]['host_id']]))
-                hos = ([e.serialize() for e in hosts])
-
-                ser_port = Service_Port.query.filter(Service_Port.service_id.in_( [json_ser['services'][n]['service_id']] ))
-                s_port = ([e.serialize() for e in ser_port])
-
-                list_por = []
-                for k in range(len(s_port)):
-                    list_por.append(s_port[k]['port_id'])
-
-                ports = Port.query.filter(Port.port_id.in_(list_por))
-                por = ([e.serialize() for e in ports])
-
-                json_ports = {}
-                for val in por:
-                    json_ports.setdefault('ports', []).append(val['port'])
-
-                json_ser['services'][n].update({ "ports" : json_ports['ports'] })
-
-                json_ser['services'][n].update({ "address" : str(hos[0]['address']) })
-                del json_ser['services'][n]['host_id']
-                del json_ser['services'][n]['machine']
-                del json_ser['services'][n]['service_id']
-
-            #compose
-            json_data['repositorie'][i].update({"services": json_ser['services']})
-            json_data['repositorie'][i].update({"categories": json_cate['categories']})
-            json_response.setdefault("repositorie", []).append(json_data['repositorie'][i])
-
-        return jsonify(json_response)
+        return make_paginated_response(json_response, next_cursor)
 
     except Exception as e:
 	    return(str(e))
@@ -781,109 +1470,31 @@ def read_repositories():
 #| Read repositories from user                            |
 #+--------------------------------------------------------+
 @app.route("/api/v1.0/repositories_from_user/<int:user_id>", methods=['GET'])
+@catalog_etag('repositories')
 def read_repositories_from_user(user_id):
     try:
-        #query all
-        repositories=Repositorie.query.all()
-
-        #get lists
-        data = ([(make_public_repositorie(e.serialize())) for e in repositories])
-
-        if(len(data) == 0):
-            return jsonify([])
-
-        id_data = ([e.serialize() for e in repositories])
-
-        #create data dict
-        json_data = {}
-        for val in data:
-            json_data.setdefault('repositorie', []).append(val)
-
-        lista = []
+        #repositories of the groups the user belongs to
+        user_repo = (db.session.query(Repositorie_Group.repo_id)
+            .join(Groups_User, Groups_User.group_id == Repositorie_Group.group_id)
+            .filter(Groups_User.user_id == user_id))
+
+        repositories=(Repositorie.query
+            .filter(Repositorie.repo_id.in_(user_repo))
+            .order_by(Repositorie.repo_id)
+            .all())
+
+        #as before, [] when there are no repositories at all and {} when none is the user's
+        if(len(repositories) == 0):
+            if (db.session.query(Repositorie.repo_id).first() is None):
+                return jsonify([])
+            return jsonify({})
 
         #create response dict
         json_response = {}
-        for i in range(len(data)):
-
-            #create lists
-            list_ser = []
-            list_cat = []
-            list_key = []
-
-            #create lists
-            repo_ser = Repositorie_Service.query.filter(Repositorie_Service.repo_id.in_([id_data[i]['repo_id']]))
-            r_ser = ([e.serialize() for e in repo_ser])
-
-            repo_cat = Repositorie_Categorie.query.filter(Repositorie_Categorie.repo_id.in_([id_data[i]['repo_id']]))
-            r_cat = ([e.serialize() for e in repo_cat])
-
-            for j in range(len(r_ser)):
-                list_ser.append(r_ser[j]['service_id'])
-
-            for l in range(len(r_cat)):
-                list_cat.append(r_cat[l]['categorie_id'])
-
-            #create categories dict
-            categories=Categorie.query.filter(Categorie.categorie_id.in_(list_cat))
-            cate = ([e.serialize() for e in categories])
-            json_cate = {}
-            for val in cate:
-                json_cate.setdefault('categories', []).append(val['name'])
-
-            #create services dict
-            services = Service.query.filter(Service.service_id.in_(list_ser))
-            ser = ([make_public_service(e.serialize()) for e in services])
-            json_ser = {}
-            for val in ser:
-                json_ser.setdefault('services', []).append(val)
-
-            for n in range(len(ser)):
-
-                hosts = Host.query.filter(Host.host_id.in_([json_ser['services'][n]['host_id']]))
-                hos = ([e.serialize() for e in hosts])
-
-                ser_port = Service_Port.query.filter(Service_Port.service_id.in_( [json_ser['services'][n]['service_id']] ))
-                s_port = ([e.serialize() for e in ser_port])
-
-                list_por = []
-                for k in range(len(s_port)):
-                    list_por.append(s_port[k]['port_id'])
-
-                ports = Port.query.filter(Port.port_id.in_(list_por))
-                por = ([e.serialize() for e in ports])
-
-                json_ports = {}
-                for val in por:
-                    json_ports.setdefault('ports', []).append(val['port'])
-
-                json_ser['services'][n].update({ "ports" : str(json_ports['ports'][0]) })
+        for val in make_repositorie_documents(repositories, single_port=True):
+            json_response.setdefault("repositorie", []).append(val)
 
-                json_ser['services'][n].update({ "address" : str(hos[0]['address']) })
-                del json_ser['services'][n]['host_id']
-                del json_ser['services'][n]['machine']
-                del json_ser['services'][n]['service_id']
-
-            #compose
-            json_data['repositorie'][i].update({"services": json_ser['services']})
-            json_data['repositorie'][i].update({"categories": json_cate['categories']})
-            json_response.setdefault("repositorie", []).append(json_data['repositorie'][i])
-
-            #create new response dict
-            new_json_response = {}
-            for i in range(len(json_response['repositorie'])):
-
-                group_repositorie=Repositorie_Group.query.filter_by(repo_id = json_response['repositorie'][i]['repo_id']).first()
-                group_repo_json = group_repositorie.serialize()
-
-                grup_usr = Groups_User.query.filter(Groups_User.group_id.in_([ group_repo_json['group_id'] ]))
-                r_user = ([e.serialize() for e in grup_usr])
-
-                for j in range(len(r_user)):
-                    if (r_user[j]['user_id'] == user_id):
-                        new_json_response.setdefault("repositorie", []).append(json_response['repositorie'][i])
-
-
-        return jsonify(new_json_response)
+        return jsonify(json_response)
     except Exception as e:
 	    return(str(e))
 
@@ -891,77 +1502,24 @@ def read_repositories_from_user(user_id):
 #| Read repository                                        |
 #+--------------------------------------------------------+
 @app.route("/api/v1.0/repositories/<int:repo_id>", methods=['GET'])
+@catalog_etag('repositories')
 def read_repositorie(repo_id):
     try:
 
-        #query single id
-        repositories=Repositorie.query.filter_by(repo_id=repo_id).first()
-
-        #create data dict
-        json_data = (repositories.serialize())
-
-        #create lists
-        list_ser = []
-        list_cat = []
-        list_key = []
-
-        #create lists
-        repo_ser = Repositorie_Service.query.filter(Repositorie_Service.repo_id.in_([repo_id]))
-        r_ser = ([e.serialize() for e in repo_ser])
-
-        repo_cat = Repositorie_Categorie.query.filter(Repositorie_Categorie.repo_id.in_([repo_id]))
-        r_cat = ([e.serialize() for e in repo_cat])
-
-        for j in range(len(r_ser)):
-            list_ser.append(r_ser[j]['service_id'])
-
-        for l in range(len(r_cat)):
-            list_cat.append(r_cat[l]['categorie_id'])
-
-        #create categories dict
-        categories=Categorie.query.filter(Categorie.categorie_id.in_(list_cat))
-        cate = ([e.serialize() for e in categories])
-        json_cate = {}
-        for val in cate:
-            json_cate.setdefault('categories', []).append(val['name'])
-
-        #create services dict
-        services = Service.query.filter(Service.service_id.in_(list_ser))
-        ser = ([make_public_service(e.serialize()) for e in services])
-        json_ser = {}
-        for val in ser:
-            json_ser.setdefault('services', []).append(val)
+        #cached document
+        json_doc = repositorie_cache.get(repo_id)
 
-        for n in range(len(ser)):
-            hosts = Host.query.filter(Host.host_id.in_([json_ser['services'][n]['host_id']]))
-            hos = ([e.serialize() for e in hosts])
+        if (json_doc is None):
 
-            ser_port = Service_Port.query.filter(Service_Port.service_id.in_( [json_ser['services'][n]['service_id']] ))
-            s_port = ([e.serialize() for e in ser_port])
-
-            list_por = []
-            for k in range(len(s_port)):
-                list_por.append(s_port[k]['port_id'])
-
-            ports = Port.query.filter(Port.port_id.in_(list_por))
-            por = ([e.serialize() for e in ports])
-
-            json_ports = {}
-            for val in por:
-                json_ports.setdefault('ports', []).append(val['port'])
-
-            json_ser['services'][n].update({ "ports" : json_ports['ports'] })
-            json_ser['services'][n].update({ "address" : str(hos[0]['address']) })
-
-            del json_ser['services'][n]['host_id']
-            del json_ser['services'][n]['machine']
-            del json_ser['services'][n]['service_id']
+            #query single id
+            repositories=Repositorie.query.filter_by(repo_id=repo_id).first()
+            json_data = make_repositorie_documents([repositories])
+        else:
+            json_data = [format_repositorie_document(json_doc)]
 
         #create response dict
         json_response = {}
-        json_data.update(json_ser)
-        json_data.update(json_cate)
-        json_response.setdefault("repositorie", []).append(json_data)
+        json_response.setdefault("repositorie", []).extend(json_data)
 
         return jsonify(json_response)
 
@@ -995,6 +1553,8 @@ def update_repositorie(repo_id):
         new_repo.language = language
 
         db.session.commit()
+        bump_catalog_version('repositories')
+        invalidate_repositories([repo_id])
 
         return jsonify({'result': True})
     except Exception as e:
@@ -1010,6 +1570,8 @@ def delete_repositorie(repo_id):
         repositorie = db.session.query(Repositorie).filter_by(repo_id=repo_id).first()
         db.session.delete(repositorie)
         db.session.commit()
+        bump_catalog_version('repositories')
+        invalidate_repositories([repo_id])
         return jsonify({'result': True})
     except Exception as e:
 	    return(str(e))
@@ -1044,6 +1606,7 @@ def create_group():
         )
         db.session.add(group)
         db.session.commit()
+        bump_catalog_version('groups')
         group=Group.query.filter_by(name = request.json['name'], abstract = request.json['abstract'])
         return jsonify([e.serialize() for e in group])
     except Exception as e:
@@ -1053,52 +1616,23 @@ def create_group():
 #| Read groups                                            |
 #+--------------------------------------------------------+
 @app.route("/api/v1.0/groups", methods=['GET'])
+@catalog_etag('groups')
 def read_groups():
+    cursor, limit = page_args()
     try:
-        #query all
-        groups=Group.query.all()
-
-        #get lists
-        data = ([(make_public_group(e.serialize())) for e in groups])
-        id_data = ([e.serialize() for e in groups])
-
-        #create data dict
-        json_data = {}
-        for val in data:
-            json_data.setdefault('groups', []).append(val)
+        filters = ['name', 'maintainer', 'language']
+        if (is_streaming()):
+            return make_streaming_response(Group.query, Group.group_id, filters, make_group_documents, 'groups', cursor=cursor)
 
-        lista = []
+        #query page
+        groups, next_cursor = paginate(Group.query, Group.group_id, filters, cursor, limit)
 
         #create response dict
         json_response = {}
-        for i in range(len(data)):
+        for val in make_group_documents(groups):
+            json_response.setdefault("groups", []).append(val)
 
-            #create lists
-            list_user = []
-
-            #create lists
-            grup_usr = Groups_User.query.filter(Groups_User.group_id.in_([id_data[i]['group_id']]))
-
-            r_user = ([e.serialize() for e in grup_usr])
-
-            for k in range(len(r_user)):
-                list_user.append(r_user[k]['user_id'])
-
-            #create users dict
-            users=User.query.filter(User.user_id.in_(list_user))
-
-            members = ([make_public_user(e.serialize()) for e in users])
-
-            json_users = {}
-
-            for val in members:
-                json_users.setdefault('users', []).append(val)
-
-            #compose
-            json_data['groups'][i].update({"users": json_users['users']})
-            json_response.setdefault("groups", []).append(json_data['groups'][i])
-
-        return jsonify(json_response)
+        return make_paginated_response(json_response, next_cursor)
 
     except Exception as e:
 	    return(str(e))
@@ -1107,63 +1641,30 @@ def read_groups():
 #| Read groups from user                                  |
 #+--------------------------------------------------------+
 @app.route("/api/v1.0/groups_from_user/<int:user_id>", methods=['GET'])
+@catalog_etag('groups')
 def read_groups_from_users(user_id):
     try:
-        #query all
-        groups=Group.query.all()
-
-        #get lists
-        data = ([(make_public_group(e.serialize())) for e in groups])
-
-        if(len(data) == 0):
-            return jsonify([])
-
-        id_data = ([e.serialize() for e in groups])
+        #groups the user belongs to
+        user_group = (db.session.query(Groups_User.group_id)
+            .filter(Groups_User.user_id == user_id))
 
-        #create data dict
-        json_data = {}
-        for val in data:
-            json_data.setdefault('groups', []).append(val)
+        groups=(Group.query
+            .filter(Group.group_id.in_(user_group))
+            .order_by(Group.group_id)
+            .all())
 
-        lista = []
+        #as before, [] when there are no groups at all and {} when none is the user's
+        if(len(groups) == 0):
+            if (db.session.query(Group.group_id).first() is None):
+                return jsonify([])
+            return jsonify({})
 
         #create response dict
         json_response = {}
-        for i in range(len(data)):
-
-            #create lists
-            list_user = []
-
-            #create lists
-            grup_usr = Groups_User.query.filter(Groups_User.group_id.in_([id_data[i]['group_id']]))
-
-            r_user = ([e.serialize() for e in grup_usr])
-
-            for k in range(len(r_user)):
-                list_user.append(r_user[k]['user_id'])
+        for val in make_group_documents(groups):
+            json_response.setdefault("groups", []).append(val)
 
-            #create users dict
-            users=User.query.filter(User.user_id.in_(list_user))
-
-            members = ([make_public_user(e.serialize()) for e in users])
-
-            json_users = {}
-
-            for val in members:
-                json_users.setdefault('users', []).append(val)
-
-            #compose
-            json_data['groups'][i].update({"users": json_users['users']})
-            json_response.setdefault("groups", []).append(json_data['groups'][i])
-
-        #create new response dict
-        new_json_response = {}
-        for i in range(len(json_response['groups'])):
-            for j in range(len(json_response['groups'][i]['users'])):
-                if (json_response['groups'][i]['users'][j]['user_id'] == user_id):
-                    new_json_response.setdefault("groups", []).append(json_response['groups'][i])
-
-        return jsonify(new_json_response)
+        return jsonify(json_response)
 
     except Exception as e:
 	    return(str(e))
@@ -1172,36 +1673,16 @@ def read_groups_from_users(user_id):
 #| Read group                                             |
 #+--------------------------------------------------------+
 @app.route("/api/v1.0/groups/<int:group_id>", methods=['GET'])
+@catalog_etag('groups')
 def read_group(group_id):
     try:
 
         #query single id
         groups=Group.query.filter_by(group_id=group_id).first()
 
-        #create data dict
-        json_data = (groups.serialize())
-
-        #create lists
-        list_user = []
-
-        #create lists
-        grup_usr = Groups_User.query.filter(Groups_User.group_id.in_([group_id]))
-        r_user = ([e.serialize() for e in grup_usr])
-
-        for k in range(len(r_user)):
-            list_user.append(r_user[k]['user_id'])
-
-        #create users dict
-        users=User.query.filter(User.user_id.in_(list_user))
-        members = ([make_public_user(e.serialize()) for e in users])
-        json_users = {}
-        for val in members:
-            json_users.setdefault('users', []).append(val)
-
         #create response dict
         json_response = {}
-        json_data.update(json_users)
-        json_response.setdefault("groups", []).append(json_data)
+        json_response.setdefault("groups", []).extend(make_group_documents([groups]))
 
         return jsonify(json_response)
 
@@ -1241,6 +1722,7 @@ def update_group(group_id):
         new_group.custom_fields = custom_fields
 
         db.session.commit()
+        bump_catalog_version('groups')
 
         return jsonify({'result': True})
     except Exception as e:
@@ -1256,6 +1738,7 @@ def delete_group(group_id):
         group = db.session.query(Group).filter_by(group_id=group_id).first()
         db.session.delete(group)
         db.session.commit()
+        bump_catalog_version('groups')
         return jsonify({'result': True})
     except Exception as e:
 	    return(str(e))
@@ -1309,13 +1792,16 @@ def TokenRefresh():
 @jwt_required
 def UserLogoutAccess():
     jti = get_raw_jwt()['jti']
+    expires_on = datetime.datetime.utcfromtimestamp(get_raw_jwt()['exp'])
     try:
 
         revoked_token=RevokedTokenModel(
-            jti = jti
+            jti = jti,
+            expires_on = expires_on
         )
         db.session.add(revoked_token)
         db.session.commit()
+        revoked_index.add(jti, revoked_token.id)
 
         return jsonify({'message': 'Access token has been revoked'})
     except:
@@ -1328,54 +1814,52 @@ def UserLogoutAccess():
 @jwt_refresh_token_required
 def UserLogoutRefresh():
     jti = get_raw_jwt()['jti']
+    expires_on = datetime.datetime.utcfromtimestamp(get_raw_jwt()['exp'])
     try:
 
         revoked_token=RevokedTokenModel(
-            jti = jti
+            jti = jti,
+            expires_on = expires_on
         )
         db.session.add(revoked_token)
         db.session.commit()
+        revoked_index.add(jti, revoked_token.id)
 
         return jsonify({'message': 'Refresh token has been revoked'})
     except:
         return jsonify({'message': 'Something went wrong'}, 500)
 
 #+--------------------------------------------------------+
-#| File upload                                            |
+#| Process upload                                         |
 #+--------------------------------------------------------+
-@app.route("/api/v1.0/file_upload/<int:repo_id>", methods=['POST'])
-def fileUpload(repo_id):
+def process_upload(job, repo_id, workspace, filename):
     #try:
 
-        # Retrieves file uploaded
-        f = request.files.get('file')
-        file_type = f.filename.rsplit('.', 1)[1].lower()
+        path = os.path.join(workspace, filename)
+        file_type = filename.rsplit('.', 1)[1].lower()
 
         # List of file_types
         images = [] #images = ['png', 'jpg', 'jpeg', 'gif']
-        tabular = [] #['csv', 'xls', 'xlsx', 'odf']
+        tabular = ['csv', 'xls', 'xlsx']
 
         #+--------------------------------------------------------+
         #|Non-Geographic Images                                   |
         #+--------------------------------------------------------+
         if (file_type in images):
 
-            f.save(os.path.join(UPLOAD_FOLDER, f.filename))
-            return jsonify({'data_url': f.filename}, 200)
+            publish_upload(workspace, filename)
+            return {'data_url': filename}
 
         #+--------------------------------------------------------+
         #|Zip                                                     |
         #+--------------------------------------------------------+
         if (file_type == 'zip'):
 
-            # save file
-            f.save(os.path.join(UPLOAD_FOLDER, f.filename))
-            subprocess.call("unzip" + " " +  os.path.join(UPLOAD_FOLDER, f.filename) + " -d " + os.path.join(UPLOAD_FOLDER, f.filename.rsplit('.', 1)[0]), shell=True)
-
             #+--------------------------------------------------------+
             #|Shapefiles                                              |
             #+--------------------------------------------------------+
-            if (check_filetype_name(os.path.join(UPLOAD_FOLDER, f.filename),'shp') == True):
+            shapefile_names = get_shapefile_names(path)
+            if (len(shapefile_names) > 0):
 
                 #+--------------------------------------------------------+
                 #|Database                                                |
@@ -1387,9 +1871,7 @@ def fileUpload(repo_id):
                 repo_path = repo_json['path']
 
                 # get host
-                host = Host.query.filter_by(name='Host_1').first()
-                host_json = (host.serialize())
-                host_address = host_json['address']
+                host_address = get_host_address('Host_1')
                 db_port = "5433" #30040
                 geoserver_port = "8082" #30050
                 srid = "4326"
@@ -1397,55 +1879,66 @@ def fileUpload(repo_id):
                 # build url
                 url = host_address #+ '/' + repo_path     <- Uncomment to use repositorie database
 
-                # open zip
-                shapefile_name = get_shapefile_name(os.path.join(UPLOAD_FOLDER, f.filename))
-
-                # add shapefile to database
-                subprocess.call("export PGPASSWORD="+TBRD_REPO_DB_PASS+" ; shp2pgsql -s " + srid + " " + os.path.join(UPLOAD_FOLDER, f.filename.rsplit('.', 1)[0], shapefile_name) + " public." + shapefile_name.rsplit('.', 1)[0] + " | psql -h " + url + " -d geo_db " + " -p " + db_port + " -U " + TBRD_REPO_DB_USER, shell=True)
-
-                # delete zipfile,
-                subprocess.call("rm -rf " + os.path.join(UPLOAD_FOLDER, f.filename) + " ; rm -rf " + os.path.join(UPLOAD_FOLDER, f.filename.rsplit('.', 1)[0]), shell=True)
-
-                #+--------------------------------------------------------+
-                #|GeoServer                                               |
-                #+--------------------------------------------------------+
-
                 # geoserver env
                 GEOSERVER_URL = "http://" + url + ":" + geoserver_port + "/geoserver"
                 LAB_NAME = repo_json['path']
-                LAB_URI = "http://"+"tbrd.com"+"/"+LAB_NAME
+                publisher = get_publisher(GEOSERVER_URL, ttl=GEOSERVER_CACHE_TTL)
 
-                # connect catalog
-                cat = Catalog(GEOSERVER_URL + '/rest')
+                connect_args = {'host': url, 'port': db_port, 'user': TBRD_REPO_DB_USER, 'password': TBRD_REPO_DB_PASS}
 
-                # create workspace
-                #ws = cat.create_workspace(LAB_NAME, LAB_URI)
+                # add every shapefile to database in the process pool, streamed from the zip with binary COPY
+                job.stage('layers', total=len(shapefile_names))
+                pool = get_ingest_pool()
+                futures = {pool.submit(loaders.load_shapefile_task, path, shapefile_name, connect_args, int(srid)): shapefile_name
+                    for shapefile_name in shapefile_names}
 
-                # create datastore
-                #ds = cat.create_datastore(LAB_NAME+'_datastore', LAB_NAME)
-
-                #connect database
-                #ds.connection_parameters.update(host=url, port=db_port, database="geo_db", user=TBRD_REPO_DB_USER, passwd=TBRD_REPO_DB_PASS, dbtype='postgis', schema='public')
-
-                #save
-                #cat.save(ds)
-
-                # create featuretype
-                feature_name = shapefile_name.rsplit('.', 1)[0].lower()
-                workspace = cat.get_workspace(LAB_NAME)
-                data_store = cat.get_store(LAB_NAME+'_datastore', workspace)
-                ft = cat.publish_featuretype(str(feature_name), data_store, 'EPSG:4326', srs='EPSG:4326')
-
-                # build data_url
-                data_url = GEOSERVER_URL + "/ows?service=WFS&version=1.0.0&request=GetFeature&typeName="+LAB_NAME+":"+str(feature_name)+"&outputFormat=SHAPE-ZIP"
+                #+--------------------------------------------------------+
+                #|GeoServer                                               |
+                #+--------------------------------------------------------+
 
-                return jsonify({'data_url': data_url}, 200)
+                # publish each featuretype as soon as its table is loaded
+                data_urls = []
+                tables = []
+                failed = []
+                handled = set()
+                try:
+                    for future in as_completed(futures, timeout=INGEST_TIMEOUT):
+                        handled.add(future)
+                        try:
+                            feature_name = future.result()['table']
+                            publisher.publish(LAB_NAME, LAB_NAME+'_datastore', [str(feature_name)], srs='EPSG:4326')
+                            data_urls.append(publisher.wfs_url(LAB_NAME, feature_name))
+                            tables.append(feature_name)
+                        except Exception as e:
+                            failed.append({'layer': futures[future], 'error': str(e)})
+                        job.progress(len(data_urls) + len(failed))
+                except FuturesTimeoutError:
+
+                    # layers not started yet are cancelled, the tables of the running ones are dropped when they finish
+                    for future, shapefile_name in futures.items():
+                        if future not in handled:
+                            failed.append({'layer': shapefile_name, 'error': 'Timed out after {} seconds'.format(INGEST_TIMEOUT)})
+                            if not future.cancel():
+                                future.add_done_callback(partial(drop_late_layer, connect_args))
+
+                if (len(data_urls) == 0):
+                    raise Exception('No layer was loaded: ' + '; '.join([f['layer'] + ': ' + f['error'] for f in failed]))
+
+                result = {'data_urls': data_urls, 'failed': failed, 'tables': tables}
+                if (len(shapefile_names) == 1):
+                    result['data_url'] = data_urls[0]
+                return result
 
             #+--------------------------------------------------------+
             # Normal Zip                                              |
             #+--------------------------------------------------------+
             else:
 
+                job.stage('unzip')
+                with ZipFile(path, 'r') as zipObj:
+                    zipObj.extractall(os.path.join(workspace, filename.rsplit('.', 1)[0]))
+                publish_upload(workspace, filename.rsplit('.', 1)[0])
+
                 print("zip")
 
         #+--------------------------------------------------------+
@@ -1453,19 +1946,6 @@ def fileUpload(repo_id):
         #+--------------------------------------------------------+
         if (file_type in tabular):
 
-            # save file
-            f.save(os.path.join(UPLOAD_FOLDER, f.filename))
-
-            if (file_type == 'xls' or file_type == 'xlsx' or file_type == 'odf'):
-
-                # add to panda
-                panda_data = pd.read_excel(os.path.join(UPLOAD_FOLDER, f.filename))
-
-            if (file_type == 'csv'):
-
-                # add to panda
-                panda_data = pd.read_csv(os.path.join(UPLOAD_FOLDER, f.filename))
-
             #+--------------------------------------------------------+
             #|Database                                                |
             #+--------------------------------------------------------+
@@ -1476,33 +1956,313 @@ def fileUpload(repo_id):
             repo_path = repo_json['path']
 
             # get host
-            host = Host.query.filter_by(name='Host_1').first()
-            host_json = (host.serialize())
-            host_address = host_json['address']
+            host_address = get_host_address('Host_1')
             db_port = "5433" #30040
 
             # build url
             url = host_address #+ '/' + repo_path     <- Uncomment to use repositorie database
 
-            # create db engine
-            engine = create_engine('postgresql://'+TBRD_REPO_DB_USER+':'+TBRD_REPO_DB_PASS+'@'+url+':'+db_port+'/geo_db')
+            # copy rows to database in chunks, in one transaction
+            job.stage('database')
+            with engines.connect(url, db_port, TBRD_REPO_DB_USER, TBRD_REPO_DB_PASS) as connection:
+                if (file_type == 'xls' or file_type == 'xlsx'):
+                    loaded = loaders.load_excel(path, connection, table=filename.rsplit('.', 1)[0], progress=job.progress)
 
-            # panda to sql
-            panda_data.to_sql(f.filename.rsplit('.', 1)[0], engine)
+                if (file_type == 'csv'):
+                    loaded = [loaders.load_csv(path, connection, table=filename.rsplit('.', 1)[0], progress=job.progress)]
 
-            return jsonify({'data_url': f.filename}, 200)
+            publish_upload(workspace, filename)
+            return {'data_url': filename, 'tables': [table['table'] for table in loaded]}
 
         #+--------------------------------------------------------+
         #|Else                                                   |
         #+-------------------------------------------------------+
         else:
 
-            f.save(os.path.join(UPLOAD_FOLDER, f.filename))
-            return jsonify({'data_url': f.filename}, 200)
+            publish_upload(workspace, filename)
+            return {'data_url': filename}
 
     #except:
     #    return jsonify({'message': 'Something went wrong'}, 500)
 
+#reuse upload
+def reuse_upload(stored, repo_id):
+
+    # get host
+    host_address = get_host_address('Host_1')
+    db_port = "5433" #30040
+    geoserver_port = "8082" #30050
+    url = host_address
+
+    # the tables may have been dropped since the content was ingested
+    if (len(stored.tables) > 0):
+        with engines.connect(url, db_port, TBRD_REPO_DB_USER, TBRD_REPO_DB_PASS) as connection:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT count(*) FROM pg_tables WHERE schemaname = 'public' AND tablename = ANY(%s)", (stored.tables,))
+                if (cursor.fetchone()[0] != len(stored.tables)):
+                    return None
+            connection.rollback()
+
+    if (stored.kind == 'shapefile'):
+
+        # link the existing tables as layers of this repositorie, publishing only the missing ones
+        repositorie=Repositorie.query.filter_by(repo_id=repo_id).first()
+        LAB_NAME = repositorie.serialize()['path']
+        publisher = get_publisher("http://" + url + ":" + geoserver_port + "/geoserver", ttl=GEOSERVER_CACHE_TTL)
+        missing = [table for table in stored.tables if not publisher.is_published(LAB_NAME, LAB_NAME+'_datastore', table)]
+        publisher.publish(LAB_NAME, LAB_NAME+'_datastore', missing, srs='EPSG:4326')
+
+        data_urls = [publisher.wfs_url(LAB_NAME, table) for table in stored.tables]
+        result = {'data_urls': data_urls, 'failed': [], 'tables': stored.tables}
+        if (len(data_urls) == 1):
+            result['data_url'] = data_urls[0]
+        return result
+
+    # the served file must still hold this content, another upload may have replaced it,
+    # a replaced file has another size or modification time, so it is not hashed again
+    path = os.path.join(UPLOAD_FOLDER, stored.filename)
+    if (os.path.isfile(path) and os.path.getsize(path) == stored.size and os.path.getmtime(path) == stored.file_mtime):
+        return {'data_url': stored.filename, 'tables': stored.tables}
+    return None
+
+#upload lock
+@contextmanager
+def upload_lock(content_hash):
+    # one lock per exact hash, so different contents never wait on each other
+    with upload_locks_lock:
+        entry = upload_locks.setdefault(content_hash, [threading.Lock(), 0])
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with upload_locks_lock:
+            entry[1] -= 1
+            if (entry[1] == 0):
+                del upload_locks[content_hash]
+
+#ingest upload
+def ingest_upload(job, repo_id, workspace, filename, content_hash, size):
+    try:
+
+        # chunked uploads arrive without a hash, the assembled file is hashed here
+        if (content_hash is None):
+            job.stage('hash')
+            content_hash, size = hash_file(os.path.join(workspace, filename))
+
+        # identical uploads are ingested one at a time, so the second one can reuse the first
+        with upload_lock(content_hash):
+
+            stored = UploadObject.query.get(content_hash)
+            if (stored is not None):
+                job.stage('reuse')
+                result = reuse_upload(stored, repo_id)
+                if (result is not None):
+                    stored.reused += 1
+                    db.session.commit()
+                    result['dedup'] = {'content_hash': content_hash, 'reused': True, 'saved_bytes': stored.size, 'saved_seconds': stored.ingest_seconds}
+                    return result
+
+            started = time.time()
+            result = process_upload(job, repo_id, workspace, filename)
+            ingest_seconds = time.time() - started
+
+            # only complete ingests are reused, an archive with failed layers is loaded again next time
+            kind = 'shapefile' if 'data_urls' in result else ('tabular' if result.get('tables') else 'file')
+            served = os.path.join(UPLOAD_FOLDER, filename)
+            file_mtime = os.path.getmtime(served) if (kind != 'shapefile' and os.path.isfile(served)) else None
+            if (len(result.get('failed', [])) == 0):
+                try:
+                    db.session.merge(UploadObject(content_hash, filename, size, kind, result.get('tables', []), ingest_seconds, datetime.datetime.utcnow(), file_mtime))
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    app.logger.error('Upload object {} not recorded: {}'.format(content_hash, e))
+
+            result['dedup'] = {'content_hash': content_hash, 'reused': False, 'ingest_seconds': ingest_seconds}
+            return result
+    finally:
+        remove_upload_workspace(workspace)
+
+#enqueue upload
+def enqueue_upload(repo_id, workspace, filename, content_hash, size):
+    try:
+        job = ingest_jobs.submit('upload', ingest_upload, repo_id, workspace, filename, content_hash, size)
+    except queue.Full:
+        remove_upload_workspace(workspace)
+        return make_response(jsonify({'message': 'Too many uploads being processed, try again later'}), 503)
+    return make_response(jsonify({'job_id': job.id, 'status_url': url_for('get_job', job_id=job.id)}), 202)
+
+#+--------------------------------------------------------+
+#| Job status                                             |
+#+--------------------------------------------------------+
+@app.route("/api/v1.0/jobs/<job_id>", methods=['GET'])
+def get_job(job_id):
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job.serialize())
+
+#+--------------------------------------------------------+
+#| File upload                                            |
+#+--------------------------------------------------------+
+@app.route("/api/v1.0/file_upload/<int:repo_id>", methods=['POST'])
+def fileUpload(repo_id):
+
+    # Retrieves file uploaded
+    f = request.files.get('file')
+    if f is None:
+        abort(400)
+    filename = secure_filename(f.filename)
+    if (filename == '' or '.' not in filename):
+        abort(400)
+
+    # every upload gets its own workspace, so uploads with the same filename do not collide
+    workspace = make_upload_workspace(request.content_length)
+
+    # hashed while it is written, to find content that was already ingested
+    sha = hashlib.sha256()
+    size = 0
+    try:
+        with open(os.path.join(workspace, filename), 'wb') as out:
+            for block in iter(lambda: f.stream.read(COPY_BUFFER), b''):
+                sha.update(block)
+                out.write(block)
+                size += len(block)
+    except Exception:
+        remove_upload_workspace(workspace)
+        raise
+
+    return enqueue_upload(repo_id, workspace, filename, sha.hexdigest(), size)
+
+#+--------------------------------------------------------+
+#| Chunked upload init                                    |
+#+--------------------------------------------------------+
+@app.route("/api/v1.0/file_upload/<int:repo_id>/init", methods=['POST'])
+def chunked_upload_init(repo_id):
+    if not request.json or not 'filename' in request.json or not 'size' in request.json:
+        abort(400)
+
+    try:
+        filename = secure_filename(str(request.json['filename']))
+        size = int(request.json['size'])
+        chunk_size = int(request.json.get('chunk_size', CHUNK_SIZE))
+    except (TypeError, ValueError):
+        abort(400)
+    if (filename == '' or '.' not in filename or size < 1 or size > CHUNKED_UPLOAD_MAX_SIZE):
+        abort(400)
+
+    # bounded, so the chunk bookkeeping of an upload stays small
+    if (chunk_size < CHUNK_SIZE_MIN or chunk_size > CHUNK_SIZE_MAX or size > chunk_size * CHUNKED_UPLOAD_MAX_CHUNKS):
+        abort(400)
+
+    upload_id = uuid.uuid4().hex
+    path = os.path.join(CHUNKED_FOLDER, upload_id)
+    os.makedirs(os.path.join(path, 'chunks'))
+
+    # chunks are written straight into the file that finalize moves into place
+    with open(os.path.join(path, 'data.part'), 'wb') as f:
+        f.truncate(size)
+
+    manifest = {
+        'upload_id': upload_id,
+        'repo_id': repo_id,
+        'filename': filename,
+        'size': size,
+        'chunk_size': chunk_size,
+        'chunks': max(1, int(math.ceil(size / float(chunk_size))))
+    }
+    with open(os.path.join(path, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f)
+
+    return jsonify(manifest)
+
+#+--------------------------------------------------------+
+#| Chunked upload status                                  |
+#+--------------------------------------------------------+
+@app.route("/api/v1.0/chunked_uploads/<string:upload_id>", methods=['GET'])
+def chunked_upload_status(upload_id):
+    path = chunked_upload_dir(upload_id)
+    manifest = read_chunked_manifest(path)
+    received = received_chunks(path)
+    manifest.update({
+        'received': received,
+        'missing': sorted(set(range(manifest['chunks'])) - set(received))
+    })
+    return jsonify(manifest)
+
+#+--------------------------------------------------------+
+#| Chunked upload chunk                                   |
+#+--------------------------------------------------------+
+@app.route("/api/v1.0/chunked_uploads/<string:upload_id>/<int:index>", methods=['PUT'])
+def chunked_upload_chunk(upload_id, index):
+    path = chunked_upload_dir(upload_id)
+    manifest = read_chunked_manifest(path)
+    checksum = request.headers.get('X-Chunk-SHA256', '').lower()
+    if (index >= manifest['chunks'] or checksum == ''):
+        abort(400)
+
+    offset = index * manifest['chunk_size']
+    expected = min(manifest['chunk_size'], manifest['size'] - offset)
+
+    # a chunk being rewritten is not received until its checksum matches again
+    marker = os.path.join(path, 'chunks', str(index))
+    if os.path.exists(marker):
+        os.remove(marker)
+
+    sha = hashlib.sha256()
+    written = 0
+    with open(os.path.join(path, 'data.part'), 'r+b') as f:
+        f.seek(offset)
+        while True:
+            buf = request.stream.read(COPY_BUFFER)
+            if not buf:
+                break
+            written += len(buf)
+            if (written > expected):
+                break
+            sha.update(buf)
+            f.write(buf)
+        f.flush()
+        os.fsync(f.fileno())
+
+    if (written != expected or sha.hexdigest() != checksum):
+        return make_response(jsonify({'message': 'Chunk {} does not match its size or checksum'.format(index)}), 400)
+
+    with open(marker + '.tmp', 'w') as m:
+        m.write(checksum)
+    os.replace(marker + '.tmp', marker)
+
+    return jsonify({'upload_id': upload_id, 'index': index, 'received': len(received_chunks(path)), 'chunks': manifest['chunks']})
+
+#+--------------------------------------------------------+
+#| Chunked upload finalize                                |
+#+--------------------------------------------------------+
+@app.route("/api/v1.0/chunked_uploads/<string:upload_id>/finalize", methods=['POST'])
+def chunked_upload_finalize(upload_id):
+    path = chunked_upload_dir(upload_id)
+    try:
+        manifest = read_chunked_manifest(path)
+        missing = sorted(set(range(manifest['chunks'])) - set(received_chunks(path)))
+    except FileNotFoundError:
+        # finalized meanwhile
+        abort(404)
+    if (len(missing) > 0):
+        return make_response(jsonify({'message': 'Upload is incomplete', 'missing': missing}), 400)
+
+    # the assembled file is already on disk, so its workspace stays on disk and the move is a rename
+    workspace = make_upload_workspace(manifest['size'], memory=False)
+    try:
+        os.replace(os.path.join(path, 'data.part'), os.path.join(workspace, manifest['filename']))
+    except FileNotFoundError:
+        # a concurrent finalize of this upload took the file
+        remove_upload_workspace(workspace)
+        return make_response(jsonify({'message': 'Upload is already finalized'}), 409)
+    shutil.rmtree(path, ignore_errors=True)
+
+    # hashed by the job, not while the request waits
+    return enqueue_upload(manifest['repo_id'], workspace, manifest['filename'], None, None)
+
 #+--------------------------------------------------------+
 #| Download file                                          |
 #+--------------------------------------------------------+
@@ -1520,19 +2280,100 @@ def download_file(filename):
 #+--------------------------------------------------------+
 @app.route("/api/v1.0/bbox_search/<string:bbox>", methods=['POST'])
 def bbox_search(bbox):
-    if not request.json:
+    if not request.is_json:
+        abort(400)
+    bbox=bbox.replace("'",'"')
+    try:
+        bbox = parse_geometry(bbox)
+        bbox_key = json.dumps(bbox, sort_keys=True, separators=(',', ':'))
+        stats = {'hits': 0, 'misses': 0}
+
+        # datasets are parsed from the body as they arrive, only matches are kept
+        results = ijson.items(request.stream, 'result.results.item', use_float=True)
+        datasets_spatial = []
+        while True:
+            batch = list(itertools.islice(results, BBOX_SEARCH_BATCH))
+            if (len(batch) == 0):
+                break
+            verdicts = check_datasets(batch, bbox, bbox_key, stats)
+            datasets_spatial.extend([item for item, verdict in zip(batch, verdicts) if verdict])
+
+        return make_search_response(datasets_spatial, stats)
+
+    except Exception as e:
+        return(str(e))
+
+#+--------------------------------------------------------+
+#| BBox Search (batch)                                    |
+#+--------------------------------------------------------+
+@app.route("/api/v1.0/bbox_search_batch", methods=['POST'])
+def bbox_search_batch():
+    if not request.json or not 'regions' in request.json:
         abort(400)
+    predicate = request.json.get('predicate', 'contains')
+    if predicate not in SPATIAL_PREDICATES:
+        abort(400)
+    try:
+        regions = request.json['regions']
+        if isinstance(regions, dict):
+            names = list(regions.keys())
+        else:
+            names = list(range(len(regions)))
+        geometries = [parse_geometry(regions[name]) for name in names]
+
+        results = request.json['result']['results']
+        dataset_ids = [item.get('id', item.get('name')) for item in results]
+        matches = search_regions(geometries, [get_spatial(item) for item in results], predicate)
+
+        if isinstance(regions, dict):
+            result = dict([(name, [dataset_ids[i] for i in match]) for name, match in zip(names, matches)])
+        else:
+            result = [[dataset_ids[i] for i in match] for match in matches]
+
+        return jsonify(dict(success="true", predicate=predicate, result=result))
+
+    except Exception as e:
+        return(str(e))
+
+#+--------------------------------------------------------+
+#| BBox Search (dataset extents index)                    |
+#+--------------------------------------------------------+
+@app.route("/api/v1.0/bbox_search/<string:bbox>", methods=['GET'])
+def bbox_search_index(bbox):
     bbox=bbox.replace("'",'"')
-    datasets=request.json
-    datasets_spatial = []
     try:
-        for item in datasets['result']['results']:
-            if(check_spatial(item, bbox)):
-                datasets_spatial.append(item)
-        return_dict = dict(help="http://localhost:5000/api/3/action/help_show?name=package_search", success="true", result = dict(count= len(datasets_spatial), sort= "score desc, metadata_modified desc", facets={}, results=datasets_spatial))
-        return jsonify(return_dict)
+        bbox = parse_geometry(bbox)
+
+        if (request.args.get('engine', BBOX_SEARCH_ENGINE) == 'memory'):
+            dataset_ids = extent_index.search(load_geometry(bbox), lambda ids: check_dataset_extents(ids, bbox))
+            extents = []
+            if (len(dataset_ids) > 0):
+                extents = (DatasetExtent.query
+                    .filter(DatasetExtent.dataset_id.in_(dataset_ids))
+                    .order_by(DatasetExtent.metadata_modified.desc())
+                    .all())
+        else:
+            extents = (DatasetExtent.query
+                .filter(func.ST_Contains(func.ST_SetSRID(func.ST_GeomFromGeoJSON(json.dumps(bbox)), 4326), DatasetExtent.extent))
+                .order_by(DatasetExtent.metadata_modified.desc())
+                .all())
 
+        return make_search_response([e.package for e in extents])
+
+    except Exception as e:
+        return(str(e))
+
+#+--------------------------------------------------------+
+#| Sync dataset extents                                   |
+#+--------------------------------------------------------+
+@app.route("/api/v1.0/dataset_extents/sync", methods=['POST'])
+@jwt_required
+def dataset_extents_sync():
+    full = bool(request.json and request.json.get('full'))
+    try:
+        return jsonify(sync_dataset_extents(full))
     except Exception as e:
+        db.session.rollback()
         return(str(e))
 
 if __name__ == '__main__':
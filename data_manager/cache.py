@@ -0,0 +1,179 @@
+import threading
+import hashlib
+import math
+import time
+from collections import OrderedDict
+
+class LRUCache(object):
+
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<LRUCache {}/{}>'.format(len(self._data), self.maxsize)
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            value, expires = item
+            if expires is not None and expires < time.time():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, generation=None):
+        with self._lock:
+
+            # an invalidation happened while the value was being built
+            if generation is not None and generation != self.generation:
+                return False
+
+            expires = None if self.ttl is None else time.time() + self.ttl
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+            return True
+
+    def pop(self, key):
+        with self._lock:
+            self.generation += 1
+            item = self._data.pop(key, None)
+            return None if item is None else item[0]
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+
+class BloomFilter(object):
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(64, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / float(capacity) * math.log(2))))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def __repr__(self):
+        return '<BloomFilter {} bits, {} hashes>'.format(self.size, self.hashes)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        for pos in self._positions(key):
+            if not self._bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+class RevokedTokenIndex(object):
+
+    def __init__(self, load, lookup, refresh=30, capacity=10000, overlap=100):
+        # load(after_id) -> [(id, jti)], lookup(jti) -> bool
+        self._load = load
+        self._lookup = lookup
+        self.refresh = refresh
+        self.capacity = capacity
+        self.overlap = overlap
+        self.last_id = 0
+        self._synced = None
+        self._jtis = set()
+        self._bloom = BloomFilter(capacity)
+        self._lock = threading.RLock()
+
+    def __repr__(self):
+        return '<RevokedTokenIndex {} jti>'.format(len(self._jtis))
+
+    def __len__(self):
+        return len(self._jtis)
+
+    def _add(self, jti, id=None):
+        if id is not None:
+            self.last_id = max(self.last_id, id)
+        if jti in self._jtis:
+            return
+        self._jtis.add(jti)
+        if len(self._jtis) > self.capacity:
+            self._rebuild(self.capacity * 2)
+        else:
+            self._bloom.add(jti)
+
+    def _rebuild(self, capacity):
+        # filled before it replaces the old filter, contains() reads it without the lock
+        bloom = BloomFilter(capacity)
+        for jti in self._jtis:
+            bloom.add(jti)
+        self.capacity = capacity
+        self._bloom = bloom
+
+    def add(self, jti, id=None):
+        with self._lock:
+            self._add(jti, id)
+
+    def sync(self):
+        with self._lock:
+
+            # rows committed out of id order are caught by re-reading a small window
+            for id, jti in self._load(max(0, self.last_id - self.overlap)):
+                self._add(jti, id)
+            self._synced = time.time()
+
+    def reset(self):
+
+        # the new index is loaded aside and swapped in whole, so a concurrent
+        # contains() never sees an empty filter
+        rows = list(self._load(0))
+        jtis = set(jti for id, jti in rows)
+        capacity = self.capacity
+        while len(jtis) > capacity:
+            capacity *= 2
+        bloom = BloomFilter(capacity)
+        for jti in jtis:
+            bloom.add(jti)
+
+        with self._lock:
+            self.capacity = capacity
+            self._jtis = jtis
+            self._bloom = bloom
+            self.last_id = max([id for id, jti in rows] or [0])
+
+            # revocations committed while loading
+            self.sync()
+
+    def contains(self, jti):
+        if self._synced is None or time.time() - self._synced > self.refresh:
+            self.sync()
+
+        if jti not in self._bloom:
+            return False
+        if jti in self._jtis:
+            return True
+
+        # possible hit, confirm on the database
+        if self._lookup(jti):
+            self.add(jti)
+            return True
+        return False
@@ -0,0 +1,71 @@
+from sqlalchemy.engine.url import URL
+from sqlalchemy import create_engine
+from contextlib import contextmanager
+import threading
+import time
+
+class EngineRegistry(object):
+
+    def __init__(self, pool_size=5, max_overflow=5, idle=600, recycle=1800):
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.idle = idle
+        self.recycle = recycle
+        self._engines = {}
+        self._used = {}
+        self._evicted = time.time()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<EngineRegistry {} engines>'.format(len(self._engines))
+
+    def __len__(self):
+        return len(self._engines)
+
+    def get(self, host, port, user, password, database='geo_db'):
+        key = (host, str(port), database, user)
+        with self._lock:
+            now = time.time()
+            if now - self._evicted > self.idle:
+                self._evict(now)
+
+            engine = self._engines.get(key)
+            if engine is None:
+                # pre_ping drops connections the server closed while they sat in the pool
+                engine = create_engine(URL('postgresql+psycopg2', username=user, password=password, host=host, port=port, database=database),
+                    pool_size=self.pool_size, max_overflow=self.max_overflow, pool_recycle=self.recycle, pool_pre_ping=True)
+                self._engines[key] = engine
+            self._used[key] = now
+            return engine
+
+    @contextmanager
+    def connect(self, host, port, user, password, database='geo_db'):
+        # yields the psycopg2 connection of a pooled checkout, returned to the pool on exit
+        pooled = self.get(host, port, user, password, database).raw_connection()
+        try:
+            yield pooled.connection
+        finally:
+            pooled.close()
+
+    def _evict(self, now):
+        for key in [key for key, used in self._used.items() if now - used > self.idle]:
+            engine = self._engines[key]
+            if engine.pool.checkedout() == 0:
+                engine.dispose()
+                del self._engines[key]
+                del self._used[key]
+        self._evicted = now
+
+    def evict(self):
+        with self._lock:
+            self._evict(time.time())
+
+    def dispose(self):
+        with self._lock:
+            for engine in self._engines.values():
+                engine.dispose()
+            self._engines.clear()
+            self._used.clear()
+
+#engines of this process
+engines = EngineRegistry()
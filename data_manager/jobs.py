@@ -0,0 +1,126 @@
+import threading
+import queue
+import uuid
+import time
+
+class Job(object):
+
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.state = 'queued'
+        self.stages = []
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<Job {} {}>'.format(self.id, self.state)
+
+    def stage(self, name, total=None):
+        with self._lock:
+            now = time.time()
+            if self.stages and self.stages[-1]['state'] == 'running':
+                self.stages[-1]['state'] = 'done'
+                self.stages[-1]['finished'] = now
+            self.stages.append({'name': name, 'state': 'running', 'done': 0, 'total': total, 'started': now, 'finished': None})
+
+    def progress(self, done, total=None):
+        with self._lock:
+            if self.stages:
+                self.stages[-1]['done'] = done
+                if total is not None:
+                    self.stages[-1]['total'] = total
+
+    def finish(self, state, result=None, error=None):
+        with self._lock:
+            now = time.time()
+            for stage in self.stages:
+                if stage['state'] == 'running':
+                    stage['state'] = 'done' if state == 'done' else 'failed'
+                    stage['finished'] = now
+            self.state = state
+            self.result = result
+            self.error = error
+            self.finished = now
+
+    def serialize(self):
+        with self._lock:
+            return {
+                'job_id': self.id,
+                'name': self.name,
+                'state': self.state,
+                'stages': [dict(stage) for stage in self.stages],
+                'result': self.result,
+                'error': self.error,
+                'created': self.created,
+                'started': self.started,
+                'finished': self.finished
+            }
+
+class JobQueue(object):
+
+    def __init__(self, workers=2, maxsize=100, ttl=3600, context=None):
+        # context() wraps every job, e.g. app.app_context
+        self.workers = workers
+        self.ttl = ttl
+        self._context = context
+        self._queue = queue.Queue(maxsize)
+        self._jobs = {}
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<JobQueue {} queued, {} jobs>'.format(self._queue.qsize(), len(self._jobs))
+
+    def start(self):
+        with self._lock:
+            while len(self._threads) < self.workers:
+                thread = threading.Thread(target=self._work, name='job-worker-{}'.format(len(self._threads)), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def submit(self, name, func, *args, **kwargs):
+        # func(job, *args, **kwargs), raises queue.Full when the queue is saturated
+        self.start()
+        self._expire()
+        job = Job(name)
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait((job, func, args, kwargs))
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+            raise
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _expire(self):
+        now = time.time()
+        with self._lock:
+            for job_id in [job.id for job in self._jobs.values() if job.finished is not None and now - job.finished > self.ttl]:
+                del self._jobs[job_id]
+
+    def _work(self):
+        while True:
+            job, func, args, kwargs = self._queue.get()
+            job.state = 'running'
+            job.started = time.time()
+            try:
+                if self._context is None:
+                    result = func(job, *args, **kwargs)
+                else:
+                    with self._context():
+                        result = func(job, *args, **kwargs)
+                job.finish('done', result=result)
+            except Exception as e:
+                job.finish('failed', error=str(e))
+            finally:
+                self._queue.task_done()
@@ -0,0 +1,531 @@
+from psycopg2 import sql
+from zipfile import ZipFile
+import shapefile
+import openpyxl
+import xlrd
+import datetime
+import math
+import csv
+from engines import engines
+import struct
+import re
+import io
+
+# PGCOPY binary format
+COPY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('>ii', 0, 0)
+COPY_TRAILER = struct.pack('>h', -1)
+COPY_NULL = struct.pack('>i', -1)
+POSTGRES_EPOCH = datetime.date(2000, 1, 1)
+
+# rows encoded per read of the COPY stream
+COPY_BATCH = 1000
+
+DEFAULT_SRID = 4326
+
+# tabular rows used to infer column types, and rows sent per COPY
+TABLE_SAMPLE = 1000
+TABLE_CHUNK = 50000
+
+INTEGER_RE = re.compile(r'^[+-]?\d{1,18}$')
+NUMBER_RE = re.compile(r'^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$')
+
+# candidate types in inference order, and what each one widens to
+COLUMN_TYPES = ['bigint', 'double precision', 'boolean', 'date', 'timestamp', 'text']
+WIDEN_TYPES = {
+    'bigint': ['bigint', 'double precision', 'text'],
+    'double precision': ['double precision', 'text'],
+    'boolean': ['boolean', 'text'],
+    'date': ['date', 'timestamp', 'text'],
+    'timestamp': ['timestamp', 'text'],
+    'text': ['text']
+}
+
+WKB_TYPES = {
+    'Point': 1,
+    'LineString': 2,
+    'Polygon': 3,
+    'MultiPoint': 4,
+    'MultiLineString': 5,
+    'MultiPolygon': 6
+}
+
+# shapefile shape types to PostGIS column types, lines and polygons are promoted to multi
+SHAPE_TYPES = {
+    shapefile.POINT: 'Point',
+    shapefile.POINTZ: 'Point',
+    shapefile.POINTM: 'Point',
+    shapefile.POLYLINE: 'MultiLineString',
+    shapefile.POLYLINEZ: 'MultiLineString',
+    shapefile.POLYLINEM: 'MultiLineString',
+    shapefile.POLYGON: 'MultiPolygon',
+    shapefile.POLYGONZ: 'MultiPolygon',
+    shapefile.POLYGONM: 'MultiPolygon',
+    shapefile.MULTIPOINT: 'MultiPoint',
+    shapefile.MULTIPOINTZ: 'MultiPoint',
+    shapefile.MULTIPOINTM: 'MultiPoint'
+}
+
+class IteratorStream(io.RawIOBase):
+
+    # file-like view of an iterator of bytes, consumed by copy_expert
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        while not self._buffer:
+            try:
+                self._buffer = next(self._chunks)
+            except StopIteration:
+                return 0
+        n = min(len(b), len(self._buffer))
+        b[:n] = self._buffer[:n]
+        self._buffer = self._buffer[n:]
+        return n
+
+#table name
+def table_name(name):
+    return name.rsplit('/', 1)[-1].rsplit('.', 1)[0].lower()
+
+#layer name
+def layer_name(member):
+    # the directories of the archive member are kept, 2019/prodes.shp and 2020/prodes.shp load as 2019_prodes and 2020_prodes
+    return member.rsplit('.', 1)[0].strip('/').replace('/', '_').lower()
+
+#ewkb
+def write_wkb(geometry, out, srid=None):
+    geometry_type = geometry['type']
+    if srid is None:
+        out += struct.pack('<BI', 1, WKB_TYPES[geometry_type])
+    else:
+        out += struct.pack('<BII', 1, WKB_TYPES[geometry_type] | 0x20000000, srid)
+
+    coordinates = geometry['coordinates']
+    if geometry_type == 'Point':
+        out += struct.pack('<dd', coordinates[0], coordinates[1])
+    elif geometry_type == 'LineString':
+        write_wkb_points(coordinates, out)
+    elif geometry_type == 'Polygon':
+        out += struct.pack('<I', len(coordinates))
+        for ring in coordinates:
+            write_wkb_points(ring, out)
+    else:
+        part_type = geometry_type[len('Multi'):]
+        out += struct.pack('<I', len(coordinates))
+        for part in coordinates:
+            write_wkb({'type': part_type, 'coordinates': part}, out)
+    return out
+
+#ewkb points
+def write_wkb_points(points, out):
+    flat = [c for point in points for c in point[:2]]
+    out += struct.pack('<I%dd' % len(flat), len(points), *flat)
+
+#promote to multi
+def to_multi(geometry, column_type):
+    if geometry['type'] == column_type:
+        return geometry
+    return {'type': column_type, 'coordinates': [geometry['coordinates']]}
+
+#dbf field to column
+def dbf_column(field):
+    name, field_type, size, decimal = field
+    if field_type == 'N' and decimal == 0 and size <= 18:
+        return 'bigint', encode_bigint
+    if field_type in ['N', 'F']:
+        return 'double precision', encode_double
+    if field_type == 'L':
+        return 'boolean', encode_boolean
+    if field_type == 'D':
+        return 'date', encode_date
+    return 'text', encode_text
+
+#binary encoders
+def encode_bigint(value):
+    return struct.pack('>iq', 8, int(value))
+
+def encode_double(value):
+    return struct.pack('>id', 8, float(value))
+
+def encode_boolean(value):
+    return struct.pack('>i?', 1, bool(value))
+
+def encode_date(value):
+    return struct.pack('>ii', 4, (value - POSTGRES_EPOCH).days)
+
+def encode_text(value):
+    data = str(value).rstrip().encode('utf-8')
+    return struct.pack('>i', len(data)) + data
+
+def encode_bytes(value):
+    return struct.pack('>i', len(value)) + bytes(value)
+
+#copy rows
+def copy_rows(rows, encoders):
+    row_header = struct.pack('>h', len(encoders))
+    yield COPY_HEADER
+    out = bytearray()
+    count = 0
+    for row in rows:
+        out += row_header
+        for value, encode in zip(row, encoders):
+            if value is None or value == '':
+                out += COPY_NULL
+            else:
+                try:
+                    out += encode(value)
+                except (ValueError, TypeError):
+                    out += COPY_NULL
+        count += 1
+        if count % COPY_BATCH == 0:
+            yield bytes(out)
+            out = bytearray()
+    out += COPY_TRAILER
+    yield bytes(out)
+
+#srid from prj
+def read_srid(prj):
+    # only an explicit top-level EPSG authority is trusted, as before everything else is 4326
+    match = re.search(r'AUTHORITY\[\s*"EPSG"\s*,\s*"?(\d+)"?\s*\]\s*\]\s*$', prj.strip())
+    if match:
+        return int(match.group(1))
+    return DEFAULT_SRID
+
+#shapefile members
+def shapefile_members(names, shp_name):
+    stem = shp_name.rsplit('.', 1)[0].lower()
+    members = {}
+    for name in names:
+        parts = name.rsplit('.', 1)
+        if len(parts) == 2 and parts[0].lower() == stem:
+            members[parts[1].lower()] = name
+    return members
+
+#load shapefile
+def load_shapefile(zip_path, shp_name, connection, table=None, srid=None, progress=None):
+
+    table = table or layer_name(shp_name)
+
+    with ZipFile(zip_path, 'r') as zipObj:
+        members = shapefile_members(zipObj.namelist(), shp_name)
+
+        if srid is None:
+            srid = DEFAULT_SRID
+            if 'prj' in members:
+                srid = read_srid(zipObj.read(members['prj']).decode('latin-1'))
+
+        encoding = 'utf-8'
+        if 'cpg' in members:
+            encoding = zipObj.read(members['cpg']).decode('ascii', 'ignore').strip() or encoding
+
+        # members are read from the archive, nothing is extracted
+        with zipObj.open(members['shp']) as shp, zipObj.open(members['dbf']) as dbf:
+            shx = zipObj.open(members['shx']) if 'shx' in members else None
+            try:
+                reader = shapefile.Reader(shp=shp, dbf=dbf, shx=shx, encoding=encoding, encodingErrors='replace')
+                return copy_shapefile(reader, connection, table, srid, progress)
+            finally:
+                if shx is not None:
+                    shx.close()
+
+#load shapefile task
+def load_shapefile_task(zip_path, shp_name, connect_args, srid=None):
+    # runs in a pool process, which keeps its own pooled engines between tasks
+    with engines.connect(**connect_args) as connection:
+        return load_shapefile(zip_path, shp_name, connection, srid=srid)
+
+#drop table
+def drop_table(connection, table):
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute(sql.SQL('DROP TABLE IF EXISTS {}').format(sql.Identifier('public', table)))
+
+#copy shapefile
+def copy_shapefile(reader, connection, table, srid, progress=None):
+
+    fields = [field for field in reader.fields if field[0] != 'DeletionFlag']
+    columns = [dbf_column(field) for field in fields]
+    names = [field[0].lower() for field in fields]
+    geometry_type = SHAPE_TYPES.get(reader.shapeType, 'Geometry')
+
+    total = len(reader)
+
+    def rows():
+        for n, record in enumerate(reader.iterShapeRecords()):
+            if progress is not None and n % COPY_BATCH == 0:
+                progress(n, total)
+            shape = record.shape
+            if shape.shapeType == shapefile.NULL or len(shape.points) == 0:
+                geom = None
+            else:
+                geometry = shape.__geo_interface__
+                if geometry_type.startswith('Multi'):
+                    geometry = to_multi(geometry, geometry_type)
+                geom = write_wkb(geometry, bytearray(), srid)
+            yield list(record.record) + [geom]
+
+    table_id = sql.Identifier('public', table)
+    column_defs = [sql.SQL('{} {}').format(sql.Identifier(name), sql.SQL(column[0])) for name, column in zip(names, columns)]
+
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute(sql.SQL('CREATE TABLE {} (gid serial PRIMARY KEY, {})').format(table_id,
+                sql.SQL(', ').join(column_defs + [sql.SQL('geom geometry({}, {})').format(sql.SQL(geometry_type), sql.Literal(srid))])))
+
+            cursor.copy_expert(sql.SQL('COPY {} ({}) FROM STDIN WITH (FORMAT binary)').format(table_id,
+                sql.SQL(', ').join([sql.Identifier(name) for name in names + ['geom']])).as_string(cursor),
+                IteratorStream(copy_rows(rows(), [column[1] for column in columns] + [encode_bytes])))
+
+            # index and statistics are built once, after all rows are in
+            cursor.execute(sql.SQL('CREATE INDEX ON {} USING GIST (geom)').format(table_id))
+            cursor.execute(sql.SQL('ANALYZE {}').format(table_id))
+            cursor.execute(sql.SQL('SELECT count(*) FROM {}').format(table_id))
+            count = cursor.fetchone()[0]
+
+    return {'table': table, 'srid': srid, 'geometry_type': geometry_type, 'rows': count}
+
+#check value type
+def is_bigint(value):
+    return INTEGER_RE.match(value.strip()) is not None
+
+def is_double(value):
+    return NUMBER_RE.match(value.strip()) is not None
+
+def is_boolean(value):
+    return value.strip().lower() in ['true', 'false']
+
+def is_date(value):
+    try:
+        datetime.date.fromisoformat(value.strip())
+        return True
+    except ValueError:
+        return False
+
+def is_timestamp(value):
+    try:
+        datetime.datetime.fromisoformat(value.strip())
+        return True
+    except ValueError:
+        return False
+
+TYPE_CHECKS = {
+    'bigint': is_bigint,
+    'double precision': is_double,
+    'boolean': is_boolean,
+    'date': is_date,
+    'timestamp': is_timestamp,
+    'text': lambda value: True
+}
+
+#widen column type
+def widen_type(column_type, value):
+    candidates = COLUMN_TYPES if column_type is None else WIDEN_TYPES[column_type]
+    for candidate in candidates:
+        if TYPE_CHECKS[candidate](value):
+            return candidate
+
+#infer column types
+def infer_types(rows, types):
+    for row in rows:
+        for i, value in enumerate(row):
+            if value is not None and value != '' and types[i] != 'text':
+                if types[i] is None or not TYPE_CHECKS[types[i]](value):
+                    types[i] = widen_type(types[i], value)
+    return types
+
+#column names
+def column_names(header):
+    names = []
+    for i, name in enumerate(header):
+        name = str(name).strip() if name is not None else ''
+        name = name or 'column_' + str(i + 1)
+        unique = name
+        n = 1
+        while unique in names:
+            n += 1
+            unique = name + '_' + str(n)
+        names.append(unique)
+    return names
+
+#cell text
+def cell_text(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+#copy chunk
+def copy_chunk(cursor, copy_sql, rows):
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    cursor.copy_expert(copy_sql, buffer)
+
+#load rows
+def load_rows(connection, table, header, rows, sample_size=TABLE_SAMPLE, chunk_size=TABLE_CHUNK, progress=None):
+
+    names = column_names(header)
+    width = len(names)
+    table_id = sql.Identifier('public', table)
+
+    def sized(rows):
+        for row in rows:
+            row = [cell_text(value) for value in row[:width]]
+
+            # blank lines are skipped, as the pandas readers did
+            if all(value is None or value == '' for value in row):
+                continue
+            if len(row) < width:
+                row += [None] * (width - len(row))
+            yield row
+
+    rows = sized(rows)
+    chunk = [row for _, row in zip(range(sample_size), rows)]
+    types = [column_type or 'text' for column_type in infer_types(chunk, [None] * width)]
+
+    count = 0
+    with connection:
+        with connection.cursor() as cursor:
+            cursor.execute(sql.SQL('CREATE TABLE {} ({})').format(table_id,
+                sql.SQL(', ').join([sql.SQL('{} {}').format(sql.Identifier(name), sql.SQL(column_type)) for name, column_type in zip(names, types)])))
+
+            # csv.writer quotes an empty field standing alone on its line, FORCE_NULL reads it as NULL too
+            columns = sql.SQL(', ').join([sql.Identifier(name) for name in names])
+            copy_sql = sql.SQL('COPY {} ({}) FROM STDIN WITH (FORMAT csv, FORCE_NULL ({}))').format(table_id, columns, columns).as_string(cursor)
+
+            while chunk:
+
+                # values past the sample may not fit, widen those columns before copying
+                widened = infer_types(chunk, list(types))
+                for i, column_type in enumerate(widened):
+                    if column_type != types[i]:
+                        cursor.execute(sql.SQL('ALTER TABLE {} ALTER COLUMN {} TYPE {} USING {}::{}').format(table_id,
+                            sql.Identifier(names[i]), sql.SQL(column_type), sql.Identifier(names[i]), sql.SQL(column_type)))
+                types = widened
+
+                copy_chunk(cursor, copy_sql, chunk)
+                count += len(chunk)
+                if progress is not None:
+                    progress(count)
+                chunk = [row for _, row in zip(range(chunk_size), rows)]
+
+            cursor.execute(sql.SQL('ANALYZE {}').format(table_id))
+
+    return {'table': table, 'columns': dict(zip(names, types)), 'rows': count}
+
+#load csv
+def load_csv(path, connection, table=None, progress=None):
+
+    table = table or table_name(path)
+
+    with open(path, 'r', newline='', encoding='utf-8', errors='replace') as f:
+        sample = f.read(64 * 1024)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t|')
+        except csv.Error:
+            dialect = csv.excel
+
+        reader = csv.reader(f, dialect)
+        header = next(reader, [])
+        return load_rows(connection, table, header, reader, progress=progress)
+
+#sheet rows
+def sheet_rows(rows):
+
+    # leading blank rows are skipped, the first filled row is the header
+    for row in rows:
+        if any(value is not None and value != '' for value in row):
+            header = list(row)
+            while header and (header[-1] is None or header[-1] == ''):
+                header.pop()
+            return header, rows
+    return None, rows
+
+#sheet table
+def sheet_table(table, sheet, sheets, used):
+    name = table
+    if sheets > 1:
+        name = table + '_' + re.sub(r'\s+', '_', sheet.strip().lower())
+
+    # sheets named alike once normalized, e.g. 'Data' and 'data ', get distinct tables
+    unique = name
+    n = 1
+    while unique in used:
+        n += 1
+        unique = name + '_' + str(n)
+    used.add(unique)
+    return unique
+
+#load excel
+def load_excel(path, connection, table=None, progress=None):
+
+    table = table or table_name(path)
+    file_type = path.rsplit('.', 1)[1].lower()
+    loaded = []
+    try:
+        return load_sheets(path, file_type, connection, table, loaded, progress)
+    except Exception:
+
+        # every sheet is copied in its own transaction, the tables of the sheets already loaded are dropped
+        for sheet in loaded:
+            drop_table(connection, sheet['table'])
+        raise
+
+#load sheets
+def load_sheets(path, file_type, connection, table, loaded, progress=None):
+    used = set()
+
+    # xlsx is read row by row in read-only mode, one table per sheet
+    if (file_type == 'xlsx'):
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            for sheet in workbook.worksheets:
+                header, rows = sheet_rows(sheet.iter_rows(values_only=True))
+                if header:
+                    loaded.append(load_rows(connection, sheet_table(table, sheet.title, len(workbook.worksheets), used), header, rows, progress=progress))
+            return loaded
+        finally:
+            workbook.close()
+
+    # xls sheets are loaded on demand and released once copied
+    if (file_type == 'xls'):
+        workbook = xlrd.open_workbook(path, on_demand=True)
+        try:
+            names = workbook.sheet_names()
+            for name in names:
+                sheet = workbook.sheet_by_name(name)
+                header, rows = sheet_rows(xls_rows(workbook, sheet))
+                if header:
+                    loaded.append(load_rows(connection, sheet_table(table, name, len(names), used), header, rows, progress=progress))
+                workbook.unload_sheet(name)
+            return loaded
+        finally:
+            workbook.release_resources()
+
+    raise ValueError('Unsupported spreadsheet format: ' + file_type)
+
+#xls rows
+def xls_rows(workbook, sheet):
+    for i in range(sheet.nrows):
+        row = []
+        for cell in sheet.row(i):
+            if cell.ctype == xlrd.XL_CELL_DATE:
+                row.append(xlrd.xldate.xldate_as_datetime(cell.value, workbook.datemode))
+            elif cell.ctype == xlrd.XL_CELL_BOOLEAN:
+                row.append(bool(cell.value))
+            elif cell.ctype == xlrd.XL_CELL_NUMBER and cell.value == int(cell.value):
+                row.append(int(cell.value))
+            elif cell.ctype in [xlrd.XL_CELL_EMPTY, xlrd.XL_CELL_BLANK, xlrd.XL_CELL_ERROR]:
+                row.append(None)
+            else:
+                row.append(cell.value)
+        yield row
@@ -92,10 +92,12 @@ class RevokedTokenModel(db.Model):
     __tablename__ = 'revoked_tokens'
 
     id = db.Column(db.Integer, primary_key = True)
-    jti = db.Column(db.String(120))
+    jti = db.Column(db.String(120), unique=True, nullable=False)
+    expires_on = db.Column(db.DateTime, unique=False, nullable=True)
 
-    def __init__(self, jti):
+    def __init__(self, jti, expires_on=None):
         self.jti = jti
+        self.expires_on = expires_on
 
     def __repr__(self):
         return '<id {}>'.format(self.id)
@@ -104,6 +106,7 @@ class RevokedTokenModel(db.Model):
         return {
             'id': self.id,
             'jti': self.jti,
+            'expires_on': self.expires_on,
         }
 
     @classmethod
@@ -111,6 +114,16 @@ class RevokedTokenModel(db.Model):
         query = cls.query.filter_by(jti = jti).first()
         return bool(query)
 
+    @classmethod
+    def revoked_since(cls, last_id):
+        return db.session.query(cls.id, cls.jti).filter(cls.id > last_id).order_by(cls.id).all()
+
+    @classmethod
+    def delete_expired(cls, now):
+        removed = cls.query.filter(cls.expires_on < now).delete(synchronize_session=False)
+        db.session.commit()
+        return removed
+
 class Categorie(db.Model):
 
     __tablename__ = 'categories'
@@ -363,3 +376,71 @@ class Service_Host(db.Model):
             'host_id': self.host_id,
             'service_id': self.service_id
         }
+
+class DatasetExtent(db.Model):
+
+    __tablename__ = 'dataset_extents'
+
+    dataset_id = db.Column(db.String(100), primary_key=True)
+    name = db.Column(db.String(355), unique=False, nullable=False)
+    metadata_modified = db.Column(db.DateTime, unique=False, nullable=False)
+    extent = db.Column(Geometry(srid=4326), nullable=False)
+    package = db.Column(JSONB, unique=False, nullable=False)
+
+    def __init__(self, dataset_id, name, metadata_modified, extent, package):
+        self.dataset_id = dataset_id
+        self.name = name
+        self.metadata_modified = metadata_modified
+        self.extent = extent
+        self.package = package
+
+    def __repr__(self):
+        return '<dataset_id {}>'.format(self.dataset_id)
+
+    def serialize(self):
+        return {
+            'dataset_id': self.dataset_id,
+            'name': self.name,
+            'metadata_modified': self.metadata_modified
+        }
+
+class UploadObject(db.Model):
+
+    __tablename__ = 'upload_objects'
+
+    content_hash = db.Column(db.String(64), primary_key=True)
+    filename = db.Column(db.String(255), unique=False, nullable=False)
+    size = db.Column(db.BigInteger, unique=False, nullable=False)
+    kind = db.Column(db.String(20), unique=False, nullable=False)
+    tables = db.Column(JSONB, unique=False, nullable=False)
+    ingest_seconds = db.Column(db.Float, unique=False, nullable=False)
+    reused = db.Column(db.Integer, unique=False, nullable=False, default=0)
+    created_on = db.Column(db.DateTime, unique=False, nullable=False)
+    file_mtime = db.Column(db.Float, unique=False, nullable=True)
+
+    def __init__(self, content_hash, filename, size, kind, tables, ingest_seconds, created_on, file_mtime=None):
+        self.content_hash = content_hash
+        self.filename = filename
+        self.size = size
+        self.kind = kind
+        self.tables = tables
+        self.ingest_seconds = ingest_seconds
+        self.reused = 0
+        self.created_on = created_on
+        self.file_mtime = file_mtime
+
+    def __repr__(self):
+        return '<content_hash {}>'.format(self.content_hash)
+
+    def serialize(self):
+        return {
+            'content_hash': self.content_hash,
+            'filename': self.filename,
+            'size': self.size,
+            'kind': self.kind,
+            'tables': self.tables,
+            'ingest_seconds': self.ingest_seconds,
+            'reused': self.reused,
+            'created_on': self.created_on,
+            'file_mtime': self.file_mtime
+        }
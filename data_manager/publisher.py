@@ -0,0 +1,84 @@
+from geoserver.catalog import Catalog, FailedRequestError, UploadError
+from geoserver.workspace import Workspace
+from geoserver.resource import FeatureType
+from geoserver.store import DataStore
+from requests.adapters import HTTPAdapter
+from cache import LRUCache
+import threading
+
+PUBLISH_HEADERS = {
+    "Content-type": "application/xml",
+    "Accept": "application/xml"
+}
+
+class GeoServerPublisher(object):
+
+    def __init__(self, url, ttl=300, pool_size=10, **credentials):
+        # url is the GeoServer base, e.g. http://host:8082/geoserver
+        self.url = url
+        self.catalog = Catalog(url + '/rest', **credentials)
+
+        # one keep-alive pool shared by every ingest worker
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.catalog.session.mount('http://', adapter)
+        self.catalog.session.mount('https://', adapter)
+
+        self._stores = LRUCache(256, ttl=ttl)
+
+    def __repr__(self):
+        return '<GeoServerPublisher {}>'.format(self.url)
+
+    def get_store(self, workspace, name):
+        key = (workspace, name)
+        store = self._stores.get(key)
+        if store is None:
+
+            # a single GET on the store, instead of listing every workspace and store
+            store = DataStore(self.catalog, Workspace(self.catalog, workspace), name)
+            r = self.catalog.session.get(store.href)
+            if r.status_code != 200:
+                raise FailedRequestError("No store found named: {}:{}".format(workspace, name))
+            self._stores.set(key, store)
+        return store
+
+    def feature_type(self, store, name, srs):
+        feature_type = FeatureType(self.catalog, store.workspace, store, name)
+        # written to dirty directly, the property setters would GET the not yet published type
+        feature_type.dirty.update({'name': name, 'title': name, 'enabled': True, 'advertised': True, 'srs': srs, 'nativeCRS': srs})
+        return feature_type
+
+    def publish(self, workspace, store_name, names, srs='EPSG:4326'):
+        store = self.get_store(workspace, store_name)
+        published = []
+        for name in names:
+            r = self.catalog.session.post(store.resource_url, data=self.feature_type(store, name, srs).message(), headers=PUBLISH_HEADERS)
+            if r.status_code == 404:
+
+                # the store went away since it was cached
+                self._stores.pop((workspace, store_name))
+                store = self.get_store(workspace, store_name)
+                r = self.catalog.session.post(store.resource_url, data=self.feature_type(store, name, srs).message(), headers=PUBLISH_HEADERS)
+            if r.status_code < 200 or r.status_code > 299:
+                raise UploadError(r.text)
+            published.append(name)
+        return published
+
+    def is_published(self, workspace, store_name, name):
+        store = self.get_store(workspace, store_name)
+        r = self.catalog.session.get(store.resource_url.rsplit('.', 1)[0] + '/' + name + '.xml')
+        return r.status_code == 200
+
+    def wfs_url(self, workspace, name, output_format='SHAPE-ZIP'):
+        return self.url + "/ows?service=WFS&version=1.0.0&request=GetFeature&typeName="+workspace+":"+str(name)+"&outputFormat="+output_format
+
+publishers = {}
+publishers_lock = threading.Lock()
+
+#get publisher
+def get_publisher(url, **kwargs):
+    with publishers_lock:
+        publisher = publishers.get(url)
+        if publisher is None:
+            publisher = GeoServerPublisher(url, **kwargs)
+            publishers[url] = publisher
+        return publisher
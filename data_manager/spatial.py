@@ -0,0 +1,319 @@
+import numpy as np
+
+# relative tolerance for orientation tests, near-degenerate cases are left to PostGIS
+EPSILON = 1e-12
+
+# points times edges evaluated per block
+BLOCK_SIZE = 2000000
+
+DIMENSIONS = {
+    'Point': 0,
+    'MultiPoint': 0,
+    'LineString': 1,
+    'MultiLineString': 1,
+    'Polygon': 2,
+    'MultiPolygon': 2
+}
+
+class SpatialGeometry(object):
+
+    def __init__(self, geometry):
+        geometry_type = geometry['type']
+        if geometry_type not in DIMENSIONS:
+            raise ValueError('Unsupported geometry type {}'.format(geometry_type))
+
+        coordinates = geometry['coordinates']
+        if geometry_type == 'Point':
+            paths = [[coordinates]]
+        elif geometry_type in ['MultiPoint', 'LineString']:
+            paths = [coordinates]
+        elif geometry_type in ['MultiLineString', 'Polygon']:
+            paths = coordinates
+        else:
+            paths = [ring for polygon in coordinates for ring in polygon]
+
+        self.dimension = DIMENSIONS[geometry_type]
+        self.paths = [np.array([c[:2] for c in path], dtype=float) for path in paths if len(path) > 0]
+
+        if len(self.paths) == 0:
+            self.vertices = np.empty((0, 2))
+            self.edges = np.empty((0, 4))
+            self.envelope = None
+            self.area = 0.0
+            return
+
+        self.vertices = np.concatenate(self.paths)
+        self.envelope = (self.vertices[:, 0].min(), self.vertices[:, 1].min(), self.vertices[:, 0].max(), self.vertices[:, 1].max())
+
+        if self.dimension == 0:
+            self.edges = np.empty((0, 4))
+        else:
+            self.edges = np.concatenate([np.hstack([path[:-1], path[1:]]) for path in self.paths])
+
+        self.area = 0.0
+        if self.dimension == 2:
+            for ring in self.paths:
+                self.area += abs(np.dot(ring[:-1, 0], ring[1:, 1]) - np.dot(ring[1:, 0], ring[:-1, 1])) / 2.0
+
+    def __repr__(self):
+        return '<SpatialGeometry dimension {} vertices {}>'.format(self.dimension, len(self.vertices))
+
+    def tolerance(self):
+        return EPSILON * max(1.0, np.abs(self.envelope).max()) ** 2
+
+    def is_rectangle(self):
+        if self.dimension != 2 or len(self.paths) != 1 or len(self.paths[0]) != 5:
+            return False
+        ring = self.paths[0]
+        if not np.array_equal(ring[0], ring[-1]):
+            return False
+        if len(np.unique(ring[:, 0])) != 2 or len(np.unique(ring[:, 1])) != 2:
+            return False
+        dx = self.edges[:, 0] == self.edges[:, 2]
+        dy = self.edges[:, 1] == self.edges[:, 3]
+        return bool(np.all(dx != dy))
+
+#load_geometry
+def load_geometry(geometry):
+    try:
+        return SpatialGeometry(geometry)
+    except:
+        return None
+
+#locate_points: 1 inside, 0 on boundary, -1 outside
+def locate_points(points, edges, tol):
+    location = np.empty(len(points), dtype=int)
+    if len(edges) == 0:
+        location.fill(-1)
+        return location
+
+    x1, y1, x2, y2 = [edges[:, k][None, :] for k in range(4)]
+    dy = y2 - y1
+    dy_safe = np.where(dy == 0, 1.0, dy)
+    seg = np.abs(x2 - x1) + np.abs(dy)
+
+    step = max(1, BLOCK_SIZE // len(edges))
+    for start in range(0, len(points), step):
+        px = points[start:start + step, 0][:, None]
+        py = points[start:start + step, 1][:, None]
+
+        # boundary
+        cross = (x2 - x1) * (py - y1) - dy * (px - x1)
+        on_boundary = ((np.abs(cross) <= tol * np.maximum(seg, 1.0))
+            & (px >= np.minimum(x1, x2)) & (px <= np.maximum(x1, x2))
+            & (py >= np.minimum(y1, y2)) & (py <= np.maximum(y1, y2))).any(axis=1)
+
+        # even-odd ray casting
+        spans = (y1 > py) != (y2 > py)
+        xint = x1 + (py - y1) * (x2 - x1) / dy_safe
+        inside = ((spans & (px < xint)).sum(axis=1) % 2) == 1
+
+        location[start:start + step] = np.where(on_boundary, 0, np.where(inside, 1, -1))
+
+    return location
+
+#edges_relation: (any proper crossing, any vertex of a on an edge of b)
+def edges_relation(b_edges, a_edges, tol):
+    if len(b_edges) == 0 or len(a_edges) == 0:
+        return False, False
+
+    ax1, ay1, ax2, ay2 = [a_edges[:, k][None, :] for k in range(4)]
+    crossing = False
+    touching = False
+
+    step = max(1, BLOCK_SIZE // len(a_edges))
+    for start in range(0, len(b_edges), step):
+        bx1, by1, bx2, by2 = [b_edges[start:start + step, k][:, None] for k in range(4)]
+
+        o1 = (ax2 - ax1) * (by1 - ay1) - (ay2 - ay1) * (bx1 - ax1)
+        o2 = (ax2 - ax1) * (by2 - ay1) - (ay2 - ay1) * (bx2 - ax1)
+        o3 = (bx2 - bx1) * (ay1 - by1) - (by2 - by1) * (ax1 - bx1)
+        o4 = (bx2 - bx1) * (ay2 - by1) - (by2 - by1) * (ax2 - bx1)
+
+        proper = (((o1 > tol) & (o2 < -tol)) | ((o1 < -tol) & (o2 > tol))) & (((o3 > tol) & (o4 < -tol)) | ((o3 < -tol) & (o4 > tol)))
+        if proper.any():
+            crossing = True
+            break
+
+        minx, maxx = np.minimum(bx1, bx2), np.maximum(bx1, bx2)
+        miny, maxy = np.minimum(by1, by2), np.maximum(by1, by2)
+        touch_1 = (np.abs(o3) <= tol) & (ax1 >= minx) & (ax1 <= maxx) & (ay1 >= miny) & (ay1 <= maxy)
+        touch_2 = (np.abs(o4) <= tol) & (ax2 >= minx) & (ax2 <= maxx) & (ay2 >= miny) & (ay2 <= maxy)
+        if (touch_1 | touch_2).any():
+            touching = True
+
+    return crossing, touching
+
+#contains_rectangle
+def contains_rectangle(rectangle, geometry):
+
+    # the envelope test already put every vertex in the closed rectangle
+    minx, miny, maxx, maxy = rectangle.envelope
+
+    if geometry.dimension == 2 and geometry.area > 0:
+        return True
+
+    if geometry.dimension >= 1:
+        edges = geometry.edges[(geometry.edges[:, 0] != geometry.edges[:, 2]) | (geometry.edges[:, 1] != geometry.edges[:, 3])]
+        if len(edges) > 0:
+            vertical = (edges[:, 0] == edges[:, 2]) & ((edges[:, 0] == minx) | (edges[:, 0] == maxx))
+            horizontal = (edges[:, 1] == edges[:, 3]) & ((edges[:, 1] == miny) | (edges[:, 1] == maxy))
+            return bool((~(vertical | horizontal)).any())
+
+    vertices = geometry.vertices
+    strict = (vertices[:, 0] > minx) & (vertices[:, 0] < maxx) & (vertices[:, 1] > miny) & (vertices[:, 1] < maxy)
+    return bool(strict.any())
+
+#contains_polygon: True, False or None when undecided
+def contains_polygon(polygon, geometry):
+    tol = max(polygon.tolerance(), geometry.tolerance())
+
+    location = locate_points(geometry.vertices, polygon.edges, tol)
+    if (location == -1).any():
+        return False
+    if (location == 0).any():
+        return None
+    if geometry.dimension == 0:
+        return True
+
+    crossing, touching = edges_relation(geometry.edges, polygon.edges, tol)
+    if crossing:
+        return False
+    if touching:
+        return None
+
+    if geometry.dimension == 2:
+        location = locate_points(polygon.vertices, geometry.edges, tol)
+        if (location == 1).any():
+            return False
+        if (location == 0).any():
+            return None
+
+    return True
+
+#contains_many
+def contains_many(container, geometries, fallback=None):
+
+    verdicts = [False] * len(geometries)
+    candidates = [i for i, geometry in enumerate(geometries) if geometry is not None and geometry.envelope is not None]
+
+    if container is None or container.dimension != 2 or container.envelope is None:
+        undecided = candidates
+    else:
+
+        # envelope pre-filter for every dataset at once
+        undecided = []
+        survivors = []
+        if len(candidates) > 0:
+            envelopes = np.array([geometries[i].envelope for i in candidates])
+            minx, miny, maxx, maxy = container.envelope
+            within = (envelopes[:, 0] >= minx) & (envelopes[:, 1] >= miny) & (envelopes[:, 2] <= maxx) & (envelopes[:, 3] <= maxy)
+            survivors = [i for i, ok in zip(candidates, within) if ok]
+
+        # exact test on the survivors
+        rectangle = container.is_rectangle()
+        for i in survivors:
+            if rectangle:
+                verdict = contains_rectangle(container, geometries[i])
+            else:
+                verdict = contains_polygon(container, geometries[i])
+            if verdict is None:
+                undecided.append(i)
+            else:
+                verdicts[i] = verdict
+
+    if len(undecided) > 0 and fallback is not None:
+        for i, verdict in zip(undecided, fallback(undecided)):
+            # None is kept, the fallback could not decide
+            verdicts[i] = None if verdict is None else bool(verdict)
+
+    return verdicts
+
+class RTree(object):
+
+    # static, sort-tile-recursive packed tree, node i of a level holds children i*fanout..i*fanout+fanout-1
+    def __init__(self, envelopes, fanout=16):
+        envelopes = np.asarray(envelopes, dtype=float).reshape(-1, 4)
+        self.fanout = fanout
+        self.items = self._str_order(envelopes)
+        self.levels = [envelopes[self.items]]
+        while len(self.levels[-1]) > fanout:
+            lower = self.levels[-1]
+            starts = np.arange(0, len(lower), fanout)
+            self.levels.append(np.column_stack([
+                np.minimum.reduceat(lower[:, 0], starts),
+                np.minimum.reduceat(lower[:, 1], starts),
+                np.maximum.reduceat(lower[:, 2], starts),
+                np.maximum.reduceat(lower[:, 3], starts)]))
+
+    def __repr__(self):
+        return '<RTree {} items, {} levels>'.format(len(self.items), len(self.levels))
+
+    def __len__(self):
+        return len(self.items)
+
+    def _str_order(self, envelopes):
+        if len(envelopes) == 0:
+            return np.empty(0, dtype=int)
+        cx = (envelopes[:, 0] + envelopes[:, 2]) / 2.0
+        cy = (envelopes[:, 1] + envelopes[:, 3]) / 2.0
+        slices = int(np.ceil(np.sqrt(np.ceil(len(envelopes) / float(self.fanout)))))
+        slice_size = slices * self.fanout
+        by_x = np.argsort(cx, kind='stable')
+        order = [chunk[np.argsort(cy[chunk], kind='stable')] for chunk in np.array_split(by_x, range(slice_size, len(by_x), slice_size))]
+        return np.concatenate(order)
+
+    def query(self, envelope, within=False):
+        if len(self.items) == 0:
+            return np.empty(0, dtype=int)
+        minx, miny, maxx, maxy = envelope
+
+        candidates = np.arange(len(self.levels[-1]))
+        for depth in range(len(self.levels) - 1, -1, -1):
+            boxes = self.levels[depth][candidates]
+            if depth == 0 and within:
+                mask = (boxes[:, 0] >= minx) & (boxes[:, 1] >= miny) & (boxes[:, 2] <= maxx) & (boxes[:, 3] <= maxy)
+            else:
+                mask = (boxes[:, 0] <= maxx) & (boxes[:, 2] >= minx) & (boxes[:, 1] <= maxy) & (boxes[:, 3] >= miny)
+            candidates = candidates[mask]
+            if depth > 0:
+                children = (candidates[:, None] * self.fanout + np.arange(self.fanout)[None, :]).ravel()
+                candidates = children[children < len(self.levels[depth - 1])]
+
+        return self.items[candidates]
+
+class ExtentIndex(object):
+
+    def __init__(self):
+        self.ids = []
+        self.geometries = []
+        self.tree = RTree(np.empty((0, 4)))
+
+    def __repr__(self):
+        return '<ExtentIndex {} extents>'.format(len(self.ids))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def load(self, rows):
+        ids = []
+        geometries = []
+        for dataset_id, geometry in rows:
+            geometry = load_geometry(geometry)
+            if geometry is not None and geometry.envelope is not None:
+                ids.append(dataset_id)
+                geometries.append(geometry)
+        tree = RTree(np.array([g.envelope for g in geometries]).reshape(-1, 4))
+
+        # swap in one assignment so concurrent searches see either index
+        self.ids, self.geometries, self.tree = ids, geometries, tree
+
+    def search(self, container, fallback=None):
+        ids, geometries, tree = self.ids, self.geometries, self.tree
+        if container is None or container.envelope is None:
+            return []
+
+        candidates = sorted(tree.query(container.envelope, within=True))
+        verdicts = contains_many(container, [geometries[i] for i in candidates],
+            None if fallback is None else lambda idx: fallback([ids[candidates[i]] for i in idx]))
+        return [ids[i] for i, verdict in zip(candidates, verdicts) if verdict]
@@ -2,6 +2,8 @@ CREATE DATABASE terrabrasilisrd;
 
 \c terrabrasilisrd
 
+CREATE EXTENSION IF NOT EXISTS postgis;
+
 CREATE TABLE "users"(
   user_id serial PRIMARY KEY, 
   username VARCHAR (50) UNIQUE NOT NULL, 
@@ -16,9 +18,12 @@ CREATE TABLE "users"(
 
 CREATE TABLE revoked_tokens(
   id serial PRIMARY KEY, 
-  jti VARCHAR (355) NOT NULL
+  jti VARCHAR (355) UNIQUE NOT NULL, 
+  expires_on TIMESTAMP NULL
 );
 
+CREATE INDEX revoked_tokens_expires_on_idx ON revoked_tokens (expires_on);
+
 CREATE TABLE categories(
   categorie_id serial PRIMARY KEY, 
   name VARCHAR (50) UNIQUE NOT NULL
@@ -108,6 +113,29 @@ CREATE TABLE research_data_repositories_categories(
   FOREIGN KEY (categorie_id) REFERENCES categories (categorie_id)
 );
 
+CREATE TABLE dataset_extents(
+  dataset_id VARCHAR (100) PRIMARY KEY, 
+  name VARCHAR (355) NOT NULL, 
+  metadata_modified TIMESTAMP NOT NULL, 
+  extent geometry(Geometry, 4326) NOT NULL, 
+  package JSONB NOT NULL
+);
+
+CREATE INDEX dataset_extents_extent_idx ON dataset_extents USING GIST (extent);
+CREATE INDEX dataset_extents_metadata_modified_idx ON dataset_extents (metadata_modified);
+
+CREATE TABLE upload_objects(
+  content_hash VARCHAR (64) PRIMARY KEY, 
+  filename VARCHAR (255) NOT NULL, 
+  size BIGINT NOT NULL, 
+  kind VARCHAR (20) NOT NULL, 
+  tables JSONB NOT NULL, 
+  ingest_seconds DOUBLE PRECISION NOT NULL, 
+  reused INTEGER NOT NULL DEFAULT 0, 
+  created_on TIMESTAMP NOT NULL, 
+  file_mtime DOUBLE PRECISION
+);
+
 INSERT INTO ports (port) VALUES ('30040');
 INSERT INTO ports (port) VALUES ('30045');
 
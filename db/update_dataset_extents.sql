@@ -0,0 +1,15 @@
+\c terrabrasilisrd
+
+-- dataset extents indexed for bbox_search
+CREATE EXTENSION IF NOT EXISTS postgis;
+
+CREATE TABLE IF NOT EXISTS dataset_extents(
+  dataset_id VARCHAR (100) PRIMARY KEY, 
+  name VARCHAR (355) NOT NULL, 
+  metadata_modified TIMESTAMP NOT NULL, 
+  extent geometry(Geometry, 4326) NOT NULL, 
+  package JSONB NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS dataset_extents_extent_idx ON dataset_extents USING GIST (extent);
+CREATE INDEX IF NOT EXISTS dataset_extents_metadata_modified_idx ON dataset_extents (metadata_modified);
@@ -0,0 +1,13 @@
+\c terrabrasilisrd
+
+-- store token expiry so expired revocations can be compacted
+ALTER TABLE revoked_tokens ADD COLUMN IF NOT EXISTS expires_on TIMESTAMP NULL;
+
+-- tokens revoked before this column existed were issued with 365-day lifetimes
+UPDATE revoked_tokens SET expires_on = now() + interval '365 days' WHERE expires_on IS NULL;
+
+-- remove duplicated jti before adding the unique index
+DELETE FROM revoked_tokens a USING revoked_tokens b WHERE a.id > b.id AND a.jti = b.jti;
+
+CREATE UNIQUE INDEX IF NOT EXISTS revoked_tokens_jti_key ON revoked_tokens (jti);
+CREATE INDEX IF NOT EXISTS revoked_tokens_expires_on_idx ON revoked_tokens (expires_on);
@@ -0,0 +1,17 @@
+\c terrabrasilisrd
+
+-- uploaded content already ingested, by sha256 of the file
+CREATE TABLE IF NOT EXISTS upload_objects(
+  content_hash VARCHAR (64) PRIMARY KEY, 
+  filename VARCHAR (255) NOT NULL, 
+  size BIGINT NOT NULL, 
+  kind VARCHAR (20) NOT NULL, 
+  tables JSONB NOT NULL, 
+  ingest_seconds DOUBLE PRECISION NOT NULL, 
+  reused INTEGER NOT NULL DEFAULT 0, 
+  created_on TIMESTAMP NOT NULL, 
+  file_mtime DOUBLE PRECISION
+);
+
+-- served file modification time, to check it still holds the content without hashing it again
+ALTER TABLE upload_objects ADD COLUMN IF NOT EXISTS file_mtime DOUBLE PRECISION;